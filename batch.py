@@ -0,0 +1,138 @@
+import argparse
+import itertools
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import noisefield
+from pipeline import generate_world
+from world import BIOME_COLORS, WATER_BIOMES
+from worldfile import create_archive_file, create_layer, new_world_id
+
+# -----------------------------
+# Пакетная генерация множества миров в один HDF5
+# -----------------------------
+# Каждый мир считается целиком в отдельном процессе и возвращает родителю
+# только компактные слои (uint8/int16/float32). Файл открыт на запись
+# только в родителе: /worlds/<имя>/<слой> плюс сводный индекс /index.
+INDEX_DTYPE = np.dtype([
+    ("name", "S32"),
+    ("seed", np.int64),
+    ("width", np.int32),
+    ("height", np.int32),
+    ("plates", np.int32),
+    ("land_fraction", np.float32),
+    ("min_height", np.float32),
+    ("max_height", np.float32),
+    ("seconds", np.float32),
+])
+
+
+def make_jobs(seeds, sizes=((64, 64),), plates_counts=(12,)):
+    """Декартово произведение seed × размер × число плит."""
+    jobs = []
+    for seed, (width, height), plates_count in itertools.product(seeds, sizes, plates_counts):
+        jobs.append(dict(name=f"world_{len(jobs):05d}", seed=seed, width=width, height=height,
+                         plates_count=plates_count))
+    return jobs
+
+
+def _init_worker():
+    # Параллелизм — на уровне миров
+    noisefield.MAX_WORKERS = 1
+
+
+def _generate_world(job, steps):
+    start = time.perf_counter()
+    world_gen = generate_world(width=job["width"], height=job["height"], plates_count=job["plates_count"],
+                               seed=job["seed"], h5_path=None, png_path=None)
+    layers = world_gen.hdf5_layers()
+    if steps is not None:
+        layers["preview"] = (world_gen.blended_image(steps=steps), np.uint8)
+    row = (job["name"], job["seed"], job["width"], job["height"], job["plates_count"],
+           1.0 - np.isin(world_gen.biome, WATER_BIOMES).mean(),
+           world_gen.height.min(), world_gen.height.max(), time.perf_counter() - start)
+    return job, layers, row
+
+
+def generate_batch(jobs, filename="worlds.h5", workers=None, steps=3, compression="gzip"):
+    """
+    Генерирует jobs (см. make_jobs) в пуле процессов и пишет всё в filename.
+    steps: шаги смешивания цветов для слоя preview (None — без него)
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = list(jobs)
+    order = {job["name"]: i for i, job in enumerate(jobs)}
+    rows = [None] * len(jobs)
+    queue = iter(jobs)
+    start = time.perf_counter()
+
+    with create_archive_file(filename, len(jobs)) as f, ProcessPoolExecutor(max_workers=workers,
+                                                                           initializer=_init_worker) as pool:
+        worlds = f.create_group("worlds")
+        # Не больше 2*workers миров в полёте
+        pending = {pool.submit(_generate_world, job, steps) for job in itertools.islice(queue, 2 * workers)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                job, layers, row = future.result()
+                group = worlds.create_group(job["name"])
+                for key in ("seed", "width", "height", "plates_count"):
+                    group.attrs[key] = job[key]
+                group.attrs["world_id"] = new_world_id()
+                for name, (data, dtype) in layers.items():
+                    create_layer(group, name, data.shape, dtype, data=data, compression=compression)
+                group["biome"].attrs["colors"] = BIOME_COLORS
+                rows[order[job["name"]]] = row
+                print(f"[INFO] {job['name']} (seed {job['seed']}, {job['width']}x{job['height']}) done")
+
+                job = next(queue, None)
+                if job is not None:
+                    pending.add(pool.submit(_generate_world, job, steps))
+
+        f.create_dataset("index", data=np.array(rows, dtype=INDEX_DTYPE))
+
+    elapsed = time.perf_counter() - start
+    print(f"[INFO] {len(jobs)} worlds exported to {filename} in {elapsed:.1f} s ({workers} workers)")
+    return rows
+
+
+def _parse_seeds(text):
+    # "0-99" или "1,5,7"
+    seeds = []
+    for part in text.split(","):
+        if "-" in part[1:]:
+            lo, hi = part.split("-", 1)
+            seeds.extend(range(int(lo), int(hi) + 1))
+        else:
+            seeds.append(int(part))
+    return seeds
+
+
+def _parse_sizes(text):
+    sizes = []
+    for part in text.split(","):
+        w, _, h = part.partition("x")
+        sizes.append((int(w), int(h or w)))
+    return sizes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетная генерация миров в один HDF5")
+    parser.add_argument("--seeds", default="0-7", help="диапазон 0-99 или список 1,5,7")
+    parser.add_argument("--sizes", default="64x64", help="размеры через запятую, например 256x256,512")
+    parser.add_argument("--plates", default="12", help="числа плит через запятую")
+    parser.add_argument("--output", default="worlds.h5")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--steps", type=int, default=3, help="смешивание цветов preview; <0 — без preview")
+    parser.add_argument("--compression", default="gzip", help="gzip, lzf или none")
+    args = parser.parse_args(argv)
+
+    jobs = make_jobs(_parse_seeds(args.seeds), _parse_sizes(args.sizes),
+                     [int(p) for p in args.plates.split(",")])
+    generate_batch(jobs, args.output, workers=args.workers, steps=args.steps if args.steps >= 0 else None,
+                   compression=None if args.compression == "none" else args.compression)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Стадийный бенчмарк конвейера генерации.
+
+    python benchmark.py                                # все размеры, результат в bench_results.json
+    python benchmark.py --sizes 64 256 --plates 12
+    python benchmark.py --baseline bench_baseline.json # сравнить с базой, код 1 при регрессии
+    python benchmark.py --sizes 64 256 --save-baseline bench_baseline.json
+
+Запуск без окон (matplotlib Agg) и без сети; сиды фиксированы.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import numpy as np
+from tectonics import TectonicsGenerator
+from world import WorldGenerator
+
+SIZES = [64, 256, 1024, 4096]
+PLATES = [12, 40]
+SEED = 1234
+STAGES = ["tectonics", "create_base_world", "detect_boundaries", "apply_terrain",
+          "assign_biomes", "export_hdf5", "blend_biomes"]
+
+
+def _measure(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def run_case(size, plates_count, seed=SEED, repeat=1):
+    """Время (мин. по повторам, с) и пик памяти (байт) каждой стадии для одного мира."""
+    best = {stage: {"time_s": float("inf"), "peak_bytes": 0} for stage in STAGES}
+
+    def record(stage, elapsed, peak):
+        best[stage]["time_s"] = min(best[stage]["time_s"], elapsed)
+        best[stage]["peak_bytes"] = max(best[stage]["peak_bytes"], peak)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(repeat):
+            tectonics_gen = TectonicsGenerator(width=size, height=size, plates_count=plates_count, seed=seed)
+            (plate_map, plates), elapsed, peak = _measure(tectonics_gen.generate)
+            record("tectonics", elapsed, peak)
+
+            world_gen = WorldGenerator(width=size, height=size, plate_map=plate_map, plates=plates, seed=seed)
+            for stage in ["create_base_world", "detect_boundaries", "apply_terrain", "assign_biomes"]:
+                _, elapsed, peak = _measure(getattr(world_gen, stage))
+                record(stage, elapsed, peak)
+
+            path = os.path.join(tmp_dir, "world_data.h5")
+            _, elapsed, peak = _measure(lambda: world_gen.export_hdf5(path))
+            record("export_hdf5", elapsed, peak)
+
+            _, elapsed, peak = _measure(lambda: world_gen.blended_image(steps=3))
+            record("blend_biomes", elapsed, peak)
+
+    return best
+
+
+def run(sizes, plates, seed=SEED, repeat=1):
+    results = {
+        "meta": {
+            "seed": seed,
+            "repeat": repeat,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "cases": {},
+    }
+    for size in sizes:
+        for plates_count in plates:
+            name = f"{size}x{size}_p{plates_count}"
+            print(f"[BENCH] {name}", flush=True)
+            stages = run_case(size, plates_count, seed=seed, repeat=repeat)
+            for stage, m in stages.items():
+                print(f"    {stage:<18} {m['time_s']*1000:10.1f} ms {m['peak_bytes']/2**20:10.1f} MiB")
+            results["cases"][name] = stages
+    return results
+
+
+def compare(results, baseline, time_threshold=1.25, memory_threshold=1.25, min_time=0.05):
+    """
+    Регрессии относительно базы: время или пик памяти стадии выросли больше порога.
+    Стадии быстрее min_time секунд по времени не сравниваются (шум таймера).
+    """
+    regressions = []
+    for case, stages in results["cases"].items():
+        base_stages = baseline.get("cases", {}).get(case)
+        if base_stages is None:
+            continue
+        for stage, m in stages.items():
+            base = base_stages.get(stage)
+            if base is None:
+                continue
+            if base["time_s"] >= min_time and m["time_s"] > base["time_s"] * time_threshold:
+                regressions.append((case, stage, "time_s", base["time_s"], m["time_s"]))
+            if base["peak_bytes"] > 0 and m["peak_bytes"] > base["peak_bytes"] * memory_threshold:
+                regressions.append((case, stage, "peak_bytes", base["peak_bytes"], m["peak_bytes"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stage-level benchmark of the world generation pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--plates", type=int, nargs="+", default=PLATES)
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", help="JSON с базовыми результатами для сравнения")
+    parser.add_argument("--save-baseline", help="сохранить результаты как новую базу")
+    parser.add_argument("--time-threshold", type=float, default=1.25)
+    parser.add_argument("--memory-threshold", type=float, default=1.25)
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="стадии быстрее этого (с) в базе не проверяются по времени")
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.plates, seed=args.seed, repeat=args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"[INFO] Results saved to {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.time_threshold, args.memory_threshold, args.min_time)
+        for case, stage, metric, base, value in regressions:
+            print(f"[REGRESSION] {case} {stage} {metric}: {base:.4g} -> {value:.4g} ({value/base:.2f}x)")
+        if regressions:
+            return 1
+        print("[INFO] No regressions against baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,260 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+from noisefield import pnoise2
+from worldfile import CHUNK as FILE_CHUNK
+
+# -----------------------------
+# Детализация чанков по данным мира
+# -----------------------------
+# Чанк (cx, cy) — это клетка мира (cx, cy), развёрнутая в CHUNK_SIZE×CHUNK_SIZE
+# пикселей. Высота и влажность билинейно интерполируются между центрами
+# клеток в глобальных координатах, поэтому соседние чанки стыкуются без
+# швов; сверху добавляется локальный шум. Всё считается массивами сразу
+# для пачки чанков.
+
+# ID совпадают с GROUND_ID / OBJECT_ID в interact.py
+GRASS, SAND, WATER, MOUNTAIN, TUNDRA = 1, 2, 3, 4, 5
+EMPTY, TREE, BUSH, ROCK, ANIMAL = 0, 1, 2, 3, 4
+
+BIOME_GROUND = {
+    "desert": SAND,
+    "tundra": TUNDRA,
+    "ice": TUNDRA,
+    "mountain": MOUNTAIN,
+}
+
+# (биом, объект, базовая вероятность, прибавка за влажность)
+OBJECT_RULES = [
+    ("tropical_forest",  TREE, 0.10, 0.20),
+    ("temperate_forest", TREE, 0.08, 0.15),
+    ("grassland",        BUSH, 0.03, 0.05),
+    ("tundra",           BUSH, 0.01, 0.02),
+    ("mountain",         ROCK, 0.08, 0.00),
+    ("desert",           ROCK, 0.01, 0.00),
+]
+ANIMAL_CHANCE = 0.002
+
+DETAIL_SCALE = 16.0       # масштаб локального шума в пикселях чанка
+DETAIL_AMPLITUDE = 100.0  # размах локального шума по высоте, м
+BEACH_HEIGHT = 15.0
+MOUNTAIN_HEIGHT = 2500.0
+BIOME_JITTER = 0.35       # доля клетки, на которую шум сдвигает границу биомов
+
+
+def _hash01(x, y, salt=0):
+    # Детерминированное «случайное» число [0, 1) для глобального пикселя
+    h = (x.astype(np.uint32) * np.uint32(0x27d4eb2d)) ^ (y.astype(np.uint32) * np.uint32(0x165667b1))
+    h = h ^ np.uint32(salt * 0x9e3779b9 & 0xffffffff)
+    h ^= h >> np.uint32(15)
+    h *= np.uint32(0x2c1b3c6d)
+    h ^= h >> np.uint32(12)
+    h *= np.uint32(0x297a2d39)
+    h ^= h >> np.uint32(15)
+    return h.astype(np.float64) / 2.0**32
+
+
+WINDOW_MARGIN = 2   # клеток вокруг чанков пачки: билинейная интерполяция и сдвиг биомов (< 1 клетки)
+MAX_WINDOW = 64     # пачка шире (в клетках) считается по одному чанку
+FILE_BLOCKS = 16    # блоков на слой в кэше _FileLayers (256² float32 — 256 КиБ)
+
+
+def _runs(index):
+    # Разбивает индексы (подряд идущие, кроме переходов через край мира)
+    # на отрезки (start, stop, позиция в окне)
+    breaks = np.nonzero(np.diff(index) != 1)[0] + 1
+    starts = np.concatenate([[0], breaks])
+    stops = np.concatenate([breaks, [len(index)]])
+    return [(int(index[a]), int(index[b - 1]) + 1, int(a)) for a, b in zip(starts, stops)]
+
+
+class _ArrayLayers:
+    """Слои мира в памяти: height, moisture и коды биомов с таблицей имён."""
+    def __init__(self, height, moisture, biome_names):
+        self.height = np.asarray(height, dtype=np.float32)
+        self.moisture = np.asarray(moisture, dtype=np.float32)
+        self.shape = self.height.shape
+        names, codes = np.unique(np.asarray(biome_names, dtype=object).astype(str), return_inverse=True)
+        self.names = [str(name) for name in names]
+        self.biome = codes.reshape(self.shape).astype(np.uint8)
+
+    def window(self, rows, cols):
+        index = np.ix_(rows, cols)
+        return self.height[index], self.moisture[index], self.biome[index]
+
+
+class _FileLayers:
+    """
+    Слои мира из WorldFile, читаемые окнами под каждую пачку чанков.
+    Окна собираются из блоков, совпадающих с чанками HDF5 (CHUNK×CHUNK):
+    последние FILE_BLOCKS блоков каждого слоя держатся в памяти, поэтому
+    соседние пачки читаются из файла (и распаковываются) один раз на блок.
+    v2: биомы читаются кодами enum, имена — из WorldFile.lookup;
+    v1: строки блока переводятся в коды по мере появления новых имён.
+    """
+    def __init__(self, world, map_size=None):
+        self.world = world
+        h, w = world.shape
+        if map_size is not None:
+            h, w = min(h, map_size), min(w, map_size)
+        self.shape = (h, w)
+        table = world.lookup("biome")
+        self._v1 = table is None
+        self.names = [] if self._v1 else [str(name) for name in table]
+        self._blocks = {}
+        self._block_shape = {}
+        # Пачки генерируются и из потока ChunkLoader, и из игрового цикла
+        self._lock = threading.Lock()
+        self.block_reads = 0
+
+    def _block(self, name, by, bx):
+        # Блок (by, bx) слоя name в сетке чанков HDF5, обрезанный по self.shape
+        blocks = self._blocks.setdefault(name, OrderedDict())
+        block = blocks.get((by, bx))
+        if block is not None:
+            blocks.move_to_end((by, bx))
+            return block
+        bh, bw = self._block_shape[name]
+        y0, x0 = by * bh, bx * bw
+        y1, x1 = min(y0 + bh, self.shape[0]), min(x0 + bw, self.shape[1])
+        if self._v1 and name == "biome":
+            block = self._codes(self.world.names(name, y0, y1, x0, x1))
+        else:
+            block = self.world.region(name, y0, y1, x0, x1)
+        self.block_reads += 1
+        blocks[(by, bx)] = block
+        if len(blocks) > FILE_BLOCKS:
+            blocks.popitem(last=False)
+        return block
+
+    def _read(self, name, rows, cols, dtype):
+        if name not in self._block_shape:
+            # Непрерывные наборы (v1) — блоками того же размера
+            self._block_shape[name] = self.world[name].chunks or (FILE_CHUNK, FILE_CHUNK)
+        bh, bw = self._block_shape[name]
+        out = np.empty((len(rows), len(cols)), dtype=dtype)
+        with self._lock:
+            for y0, y1, dy in _runs(rows):
+                for x0, x1, dx in _runs(cols):
+                    # Отрезки режутся по границам блоков
+                    for by in range(y0 // bh, (y1 - 1) // bh + 1):
+                        ys = max(y0, by * bh), min(y1, (by + 1) * bh)
+                        for bx in range(x0 // bw, (x1 - 1) // bw + 1):
+                            xs = max(x0, bx * bw), min(x1, (bx + 1) * bw)
+                            block = self._block(name, by, bx)
+                            out[dy + ys[0] - y0:dy + ys[1] - y0, dx + xs[0] - x0:dx + xs[1] - x0] = \
+                                block[ys[0] - by * bh:ys[1] - by * bh, xs[0] - bx * bw:xs[1] - bx * bw]
+        return out
+
+    def _codes(self, names):
+        unique, inverse = np.unique(names.astype(str), return_inverse=True)
+        for name in unique:
+            if name not in self.names:
+                self.names.append(str(name))
+        lut = np.array([self.names.index(name) for name in unique], dtype=np.uint8)
+        return lut[inverse].reshape(names.shape)
+
+    def window(self, rows, cols):
+        height = self._read("height", rows, cols, np.float32)
+        if "moisture" in self.world:
+            moisture = self._read("moisture", rows, cols, np.float32)
+        else:
+            moisture = np.zeros_like(height)
+        return height, moisture, self._read("biome", rows, cols, np.uint8)
+
+
+class ChunkDetailGenerator:
+    """
+    height, moisture: (H, W) float слои мира; biome_names: (H, W) имена биомов.
+    source: вместо массивов — источник окон слоёв (from_world_file).
+    Мир замкнут по обеим осям (как и координаты чанков в Game).
+    """
+    def __init__(self, height=None, moisture=None, biome_names=None, chunk_size=32, source=None):
+        self.chunk_size = chunk_size
+        self.source = source or _ArrayLayers(height, moisture, biome_names)
+        self.biome_names = []
+        self._update_tables()
+
+    def _update_tables(self):
+        # Таблицы по кодам биомов; для v1-файлов список имён растёт по мере чтения
+        names = self.source.names
+        if len(names) == len(self.biome_names):
+            return
+        self.biome_names = list(names)
+        self.biome_ground = np.array([BIOME_GROUND.get(name, GRASS) for name in names], dtype=np.uint8)
+        self.object_table = np.zeros((len(names), 3))  # объект, база, прибавка
+        for name, obj, base, per_moisture in OBJECT_RULES:
+            if name in self.biome_names:
+                self.object_table[self.biome_names.index(name)] = (obj, base, per_moisture)
+
+    @classmethod
+    def from_world_file(cls, world, map_size=None, chunk_size=32):
+        """
+        Генератор над областью [0:map_size, 0:map_size] файла (весь мир по умолчанию).
+        Слои читаются окнами вокруг запрошенных чанков: память не зависит от размера мира.
+        """
+        return cls(chunk_size=chunk_size, source=_FileLayers(world, map_size))
+
+    @staticmethod
+    def _bilinear(layer, gx, gy):
+        # gx, gy — координаты в окне; клетки +1 лежат внутри окна
+        x0 = np.floor(gx).astype(np.int64)
+        y0 = np.floor(gy).astype(np.int64)
+        fx = (gx - x0).astype(np.float32)
+        fy = (gy - y0).astype(np.float32)
+        x1 = x0 + 1
+        y1 = y0 + 1
+        top = layer[y0, x0] * (1 - fx) + layer[y0, x1] * fx
+        bottom = layer[y1, x0] * (1 - fx) + layer[y1, x1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def generate(self, keys):
+        """
+        keys: список (cx, cy). Возвращает список чанков
+        {"ground": uint8, "objects": uint8, "height": float32} того же порядка.
+        """
+        keys = np.asarray(keys, dtype=np.int64).reshape(-1, 2)
+        if len(keys) > 1 and max(np.ptp(keys[:, 0]), np.ptp(keys[:, 1])) > MAX_WINDOW:
+            return [chunk for key in keys for chunk in self.generate(key)]
+        cs = self.chunk_size
+        h, w = self.source.shape
+
+        # Окно клеток мира под пачку (с переходом через край)
+        ox = int(keys[:, 0].min()) - WINDOW_MARGIN
+        oy = int(keys[:, 1].min()) - WINDOW_MARGIN
+        cols = (ox + np.arange(int(np.ptp(keys[:, 0])) + 2 * WINDOW_MARGIN + 1)) % w
+        rows = (oy + np.arange(int(np.ptp(keys[:, 1])) + 2 * WINDOW_MARGIN + 1)) % h
+        world_height, world_moisture, world_biome = self.source.window(rows, cols)
+        self._update_tables()
+
+        # Глобальные пиксели и их положение в координатах клеток мира
+        pixel = np.arange(cs)
+        px = keys[:, 0, None, None] * cs + pixel[None, None, :]   # (N, 1, cs)
+        py = keys[:, 1, None, None] * cs + pixel[None, :, None]   # (N, cs, 1)
+        gx = (px + 0.5) / cs - 0.5 - ox
+        gy = (py + 0.5) / cs - 0.5 - oy
+
+        detail = pnoise2(px / DETAIL_SCALE, py / DETAIL_SCALE, octaves=4)
+        height = self._bilinear(world_height, gx, gy) + detail * DETAIL_AMPLITUDE
+        moisture = self._bilinear(world_moisture, gx, gy)
+
+        # Ближайшая клетка с шумовым сдвигом — неровные границы биомов
+        jitter = pnoise2(px / 8.0 + 100.0, py / 8.0 + 100.0, octaves=2) * BIOME_JITTER * 2
+        bx = np.floor(gx + 0.5 + jitter).astype(np.int64)
+        by = np.floor(gy + 0.5 + jitter).astype(np.int64)
+        biome = world_biome[by, bx]
+
+        ground = self.biome_ground[biome]
+        ground = np.where(height < BEACH_HEIGHT, SAND, ground)
+        ground = np.where(height < 0, WATER, ground)
+        ground = np.where(height > MOUNTAIN_HEIGHT, MOUNTAIN, ground).astype(np.uint8)
+
+        rule = self.object_table[biome]
+        chance = rule[..., 1] + rule[..., 2] * moisture
+        roll = _hash01(px, py)
+        objects = np.where(roll < chance, rule[..., 0], EMPTY)
+        objects = np.where((ground != WATER) & (_hash01(px, py, salt=1) < ANIMAL_CHANCE), ANIMAL, objects)
+        objects = np.where(ground == WATER, EMPTY, objects).astype(np.uint8)
+
+        height = height.astype(np.float32)
+        return [{"ground": ground[i], "objects": objects[i], "height": height[i]} for i in range(len(keys))]
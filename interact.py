@@ -1,9 +1,15 @@
 import pygame
 import sys
-import h5py
+from worldfile import WorldFile
 import os
+import math
+import threading
+import time
+import json
+from collections import OrderedDict, deque
 import numpy as np
-import noise
+from chunkgen import ChunkDetailGenerator, WINDOW_MARGIN
+from regionfile import RegionStore, FLAG_EDITED
 
 # --------------------
 # Настройки ID и цветов
@@ -40,62 +46,419 @@ OBJECT_COLORS = {
     4: (255,0,0)      # animal
 }
 
+# Палитры для отрисовки массивами: цвет = PALETTE[id]
+GROUND_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+for _id, _color in GROUND_COLORS.items():
+    GROUND_PALETTE[_id] = _color
+OBJECT_PALETTE = np.zeros((256, 3), dtype=np.uint8)
+for _id, _color in OBJECT_COLORS.items():
+    OBJECT_PALETTE[_id] = _color
+
 CHUNK_SIZE = 32
-chunk_cache = {}
+
+# --------------------
+# Кэш чанков
+# --------------------
+class ChunkCache:
+    """
+    LRU-кэш чанков с лимитом памяти в байтах поверх регион-файлов (regionfile.py).
+    Вытесненные изменённые (dirty) чанки откладываются и пишутся в directory пачкой
+    в write_pending() — из потока-загрузчика и при flush(), всегда без блокировки
+    кэша, так что игровой поток не ждёт диск; при промахе чанк сначала ищется на диске.
+    save_generated: сохранять и сгенерированные чанки, чтобы исследованный мир
+    перечитывался с диска, а не генерировался заново
+    world: WorldFile, по которому строятся чанки; сохранённые сгенерированные чанки
+    из областей, переписанных в нём позже (patch_hdf5, WorldFile.edits), не читаются,
+    а генерируются заново. Чанки с правками игрока остаются.
+    """
+    def __init__(self, directory="chunks", max_bytes=64 * 1024 * 1024, save_generated=True, world=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.save_generated = save_generated
+        self.revision = world.revision if world is not None else 0
+        self._edits = world.edits() if world is not None else np.zeros((0, 5), dtype=np.int64)
+        self._world_shape = world.shape if world is not None else None
+        self._edited = set()  # ключи чанков с правками игрока (FLAG_EDITED на диске)
+        self.store = RegionStore(directory)
+        self._chunks = OrderedDict()  # key -> chunk, в конце самые свежие
+        self._dirty = set()
+        self._pending_writes = {}  # вытесненные dirty-чанки, ещё не записанные на диск
+        self._bytes = 0
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+        self.disk_loads = 0
+        self.stale = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._chunks
+
+    def __len__(self):
+        return len(self._chunks)
+
+    @staticmethod
+    def _size(chunk):
+        return sum(layer.nbytes for layer in chunk.values())
+
+    def get(self, key):
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._chunks.move_to_end(key)
+            return chunk
+
+    def peek(self, key):
+        # Как get, но без счётчиков (опрос из игрового цикла)
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is not None:
+                self._chunks.move_to_end(key)
+            return chunk
+
+    def put(self, key, chunk, dirty=False):
+        with self._lock:
+            old = self._chunks.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._chunks[key] = chunk
+            self._bytes += self._size(chunk)
+            if dirty:
+                self._dirty.add(key)
+            self._evict()
+
+    def mark_dirty(self, key, chunk):
+        # Чанк мог быть вытеснен, пока игрок держит на него ссылку: вернуть в кэш
+        with self._lock:
+            self._edited.add(key)
+            if self._chunks.get(key) is not chunk:
+                self.put(key, chunk, dirty=True)
+            else:
+                self._dirty.add(key)
+
+    def load_many(self, keys):
+        """Чанки с диска (dict key -> чанк) для найденных ключей; кладутся в кэш."""
+        with self._lock:
+            # Вытесненные, но ещё не записанные чанки новее того, что на диске
+            revived = {key: self._pending_writes.pop(key) for key in keys if key in self._pending_writes}
+            for key, chunk in revived.items():
+                self.put(key, chunk, dirty=True)
+        keys = [key for key in keys if key not in revived]
+        stale = self._stale(keys)
+        chunks = self.store.load_many([key for key in keys if key not in stale])
+        with self._lock:
+            self.stale += len(stale)
+            self.disk_loads += len(chunks)
+            for key, chunk in chunks.items():
+                self.put(key, chunk)
+        chunks.update(revived)
+        return chunks
+
+    def _stale(self, keys):
+        # Сгенерированные чанки на диске, чью область файл мира переписал после их записи;
+        # чанк зависит от клеток мира в пределах WINDOW_MARGIN (мир замкнут)
+        if not len(self._edits):
+            return set()
+        h, w = self._world_shape
+        revision, y0, y1, x0, x1 = self._edits.T
+        stale = set()
+        for key, (saved, flags) in self.store.stamps(keys).items():
+            if flags & FLAG_EDITED:
+                continue
+            x, y = key[0] % w, key[1] % h
+            hit = ((revision > saved)
+                   & ((x - x0 + WINDOW_MARGIN) % w < x1 - x0 + 2 * WINDOW_MARGIN)
+                   & ((y - y0 + WINDOW_MARGIN) % h < y1 - y0 + 2 * WINDOW_MARGIN))
+            if hit.any():
+                stale.add(key)
+        return stale
+
+    def load(self, key):
+        """Чанк с диска (сохранённые правки) или None."""
+        return self.load_many([key]).get(key)
+
+    def _evict(self):
+        # Под self._lock; запись откладывается до write_pending()
+        while self._bytes > self.max_bytes and len(self._chunks) > 1:
+            key, chunk = self._chunks.popitem(last=False)
+            self._bytes -= self._size(chunk)
+            self.evictions += 1
+            if key in self._dirty:
+                self._dirty.discard(key)
+                self._pending_writes[key] = chunk
+
+    def write_pending(self):
+        """Пишет отложенные чанки; кэш на время записи не заблокирован."""
+        with self._lock:
+            chunks = dict(self._pending_writes)
+            stamps = {key: (self.revision, FLAG_EDITED if key in self._edited else 0) for key in chunks}
+        if not chunks:
+            return
+        self.store.save_many(chunks, stamps)
+        with self._lock:
+            self.writes += len(chunks)
+            for key, chunk in chunks.items():
+                # Чанк мог вернуться в кэш (load_many) и снова вытесниться, пока шла запись
+                if self._pending_writes.get(key) is chunk:
+                    del self._pending_writes[key]
+
+    def flush(self):
+        with self._lock:
+            self._pending_writes.update((key, self._chunks[key]) for key in self._dirty)
+            self._dirty.clear()
+        self.write_pending()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunks": len(self._chunks),
+                "bytes": self._bytes,
+                "dirty": len(self._dirty),
+                "pending_writes": len(self._pending_writes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "writes": self.writes,
+                "disk_loads": self.disk_loads,
+                "stale": self.stale,
+            }
+
+chunk_cache = ChunkCache()
+
+def chunk_directory(h5_path, world_id):
+    """Каталог регион-файлов мира: <h5 без расширения>.chunks/<world_id>."""
+    return os.path.join(os.path.splitext(h5_path)[0] + ".chunks", world_id)
+
+def use_chunk_cache(cache):
+    # Модульный кэш, с которым работают generate_chunks и ChunkLoader
+    global chunk_cache
+    chunk_cache = cache
+    return cache
 
 # --------------------
 # Генерация чанка с ID
 # --------------------
-def generate_heightmap(seed_x, seed_y):
-    heightmap = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.float32)
-    scale = 16.0
-    for y in range(CHUNK_SIZE):
-        for x in range(CHUNK_SIZE):
-            nx = (seed_x*CHUNK_SIZE+x)/scale
-            ny = (seed_y*CHUNK_SIZE+y)/scale
-            h = noise.pnoise2(nx, ny, octaves=4, persistence=0.5, lacunarity=2.0)
-            heightmap[y,x] = h
-    return heightmap
-
-def generate_chunk(world_x, world_y, biome_name):
+def generate_chunks(keys, detail):
+    """
+    Чанки для списка ключей (x, y): из кэша, с диска (одно чтение на регион)
+    или одной пачкой из ChunkDetailGenerator. Возвращает dict key -> chunk.
+    """
+    chunks = {}
+    missing = []
+    for key in keys:
+        chunk = chunk_cache.get(key)
+        if chunk is None:
+            missing.append(key)
+        else:
+            chunks[key] = chunk
+
+    if missing:
+        chunks.update(chunk_cache.load_many(missing))
+        missing = [key for key in missing if key not in chunks]
+    if missing:
+        for key, chunk in zip(missing, detail.generate(missing)):
+            chunk_cache.put(key, chunk, dirty=chunk_cache.save_generated)
+            chunks[key] = chunk
+    return chunks
+
+def generate_chunk(world_x, world_y, detail):
     key = (world_x, world_y)
-    if key in chunk_cache:
-        return chunk_cache[key]
-
-    # Ground слой: ID тайлов
-    ground_layer = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
-    for y in range(CHUNK_SIZE):
-        for x in range(CHUNK_SIZE):
-            if biome_name == "desert":
-                ground_layer[y,x] = 2
-            elif biome_name == "tundra":
-                ground_layer[y,x] = 5
-            elif biome_name == "mountain":
-                ground_layer[y,x] = 4
-            else:
-                ground_layer[y,x] = 1
+    return generate_chunks([key], detail)[key]
+
+def chunk_rgb(chunk):
+    # (CHUNK_SIZE, CHUNK_SIZE, 3): объект поверх земли
+    objects = chunk["objects"]
+    return np.where((objects != 0)[..., None], OBJECT_PALETTE[objects], GROUND_PALETTE[chunk["ground"]])
 
-    # Objects слой: изначально пустой
-    objects_layer = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=np.uint8)
+def chunk_surface(chunk):
+    # surfarray ждёт оси (x, y)
+    return pygame.surfarray.make_surface(chunk_rgb(chunk).swapaxes(0, 1))
+
+# --------------------
+# Фоновая загрузка чанков
+# --------------------
+class ChunkLoader:
+    """
+    Поток-загрузчик: генерирует чанки вне игрового цикла пачками до batch штук.
+    focus() задаёт центр и кольцо предзагрузки; запросы старого кольца
+    отменяются, очередь ограничена max_pending (ближние чанки первыми).
+    """
+    def __init__(self, detail, radius=1, max_pending=32, batch=9, on_loaded=None):
+        self.detail = detail
+        self.on_loaded = on_loaded  # вызывается из потока с ключами готовой пачки
+        self.radius = radius
+        self.max_pending = max_pending
+        self.batch = batch
+        self._pending = []  # ключи чанков, ближние к центру в начале
+        self._cond = threading.Condition()
+        self._running = True
+        self._thread = threading.Thread(target=self._work, name="chunk-loader", daemon=True)
+        self._thread.start()
+
+    def focus(self, center):
+        cx, cy = center
+        ring = sorted(
+            ((cx+dx, cy+dy) for dy in range(-self.radius, self.radius+1) for dx in range(-self.radius, self.radius+1)),
+            key=lambda key: max(abs(key[0]-cx), abs(key[1]-cy)),
+        )
+        with self._cond:
+            # Новое кольцо заменяет старые запросы (телепорт отменяет их целиком)
+            self._pending = [key for key in ring if key not in chunk_cache][:self.max_pending]
+            self._cond.notify()
+
+    def get(self, key):
+        # Не блокирует: None, если чанк ещё не готов
+        return chunk_cache.peek(key)
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._pending = []
+            self._cond.notify()
+        self._thread.join()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                keys = self._pending[:self.batch]
+                del self._pending[:self.batch]
+            generate_chunks(keys, self.detail)
+            if self.on_loaded is not None:
+                self.on_loaded(keys)
+            # Вытесненные правки пишутся здесь, а не в игровом потоке
+            chunk_cache.write_pending()
+
+    @property
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+# --------------------
+# Тайлы глобальной карты
+# --------------------
+MAP_TILE_CACHE = 64   # тайлов в памяти (~12 МБ при тайле 256)
+MAP_ZOOM_STEP = 1.25
+MAP_PAN_STEP = 64     # пикселей экрана на нажатие стрелки
+MAP_MAX_ZOOM = 64.0
+
+class MapTiles:
+    """
+    Тайлы уровней пирамиды карты как pygame-поверхности с LRU-кэшем.
+    Для файлов без пирамиды единственный уровень 0 режется из PNG.
+    """
+    def __init__(self, world, png_path=None, max_tiles=MAP_TILE_CACHE):
+        self.world = world
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self.reads = 0
+        self.read_seconds = 0.0  # время чтения и сборки тайлов (IO кадра)
+        if world.pyramid_levels:
+            self.levels = world.pyramid_levels
+            self.tile = int(world["pyramid"].attrs["tile"])
+            self._image = None
+        else:
+            self.levels = 1
+            self.tile = 256
+            image = pygame.image.load(png_path)
+            self._image = pygame.surfarray.array3d(image).transpose(1, 0, 2)
+
+    def shape(self, level):
+        if self._image is not None:
+            return self._image.shape[:2]
+        return self.world.pyramid_shape(level)
+
+    def _read(self, level, ty, tx):
+        y0, x0 = ty*self.tile, tx*self.tile
+        if self._image is not None:
+            return self._image[y0:y0+self.tile, x0:x0+self.tile]
+        return self.world.pyramid_region("color", level, y0, y0+self.tile, x0, x0+self.tile)
+
+    def get(self, level, ty, tx):
+        key = (level, ty, tx)
+        surface = self._tiles.get(key)
+        if surface is None:
+            start = time.perf_counter()
+            rgb = np.ascontiguousarray(self._read(level, ty, tx).transpose(1, 0, 2))
+            surface = pygame.surfarray.make_surface(rgb)
+            self.reads += 1
+            self.read_seconds += time.perf_counter() - start
+            self._tiles[key] = surface
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        else:
+            self._tiles.move_to_end(key)
+        return surface
 
-    chunk_cache[key] = {
-        "ground": ground_layer,
-        "objects": objects_layer
-    }
-    return chunk_cache[key]
+# --------------------
+# Время кадров
+# --------------------
+FRAME_WINDOW = 240     # кадров в окне перцентилей
+IDLE_WAIT_MS = 500     # ожидание событий; по таймауту перерисовки нет
+MAX_FPS = 60           # потолок при потоке событий (перетаскивание карты)
+CHUNK_LOADED = pygame.USEREVENT + 1
+
+class FrameStats:
+    """
+    Время перерисованных кадров по частям: update — события и состояние,
+    draw — отрисовка без IO, io — чтение тайлов карты.
+    Перцентили считаются по последним window кадрам. log_path: файл
+    JSON-строк (строка на кадр и итоговая при close).
+    """
+    def __init__(self, window=FRAME_WINDOW, log_path=None):
+        self.frames = deque(maxlen=window)  # (total, update, draw, io), мс
+        self.count = 0
+        self.wakeups = 0   # пробуждения цикла, в том числе без перерисовки
+        self.log = open(log_path, "a") if log_path else None
+
+    def record(self, update, draw, io, reason):
+        frame = (update + draw + io, update, draw, io)
+        self.frames.append(frame)
+        self.count += 1
+        if self.log is not None:
+            self.log.write(json.dumps({
+                "frame": self.count, "time": time.time(), "reason": reason,
+                "total_ms": round(frame[0], 3), "update_ms": round(update, 3),
+                "draw_ms": round(draw, 3), "io_ms": round(io, 3),
+            }) + "\n")
+
+    def summary(self):
+        if not self.frames:
+            return {"frames": self.count, "wakeups": self.wakeups}
+        data = np.array(self.frames)
+        p50, p95, p99 = np.percentile(data[:, 0], [50, 95, 99])
+        update, draw, io = data[:, 1:].mean(axis=0)
+        return {
+            "frames": self.count, "wakeups": self.wakeups,
+            "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99), "max_ms": float(data[:, 0].max()),
+            "update_ms": float(update), "draw_ms": float(draw), "io_ms": float(io),
+        }
+
+    def close(self, cache_stats=None):
+        if self.log is not None:
+            self.log.write(json.dumps({"summary": self.summary(), "chunk_cache": cache_stats}) + "\n")
+            self.log.close()
+            self.log = None
 
 # --------------------
 # Игровой класс
 # --------------------
 class Game:
-    def __init__(self):
-        self.MAP_SIZE = 64
+    def __init__(self, h5_path="world_data.h5", png_path="world_map_gradient.png", frame_log=None):
         self.WINDOW_SIZE = (1200,800)
-        self.PNG_PATH = "world_map_gradient.png"
-        self.H5_PATH = "world_data.h5"
+        self.PNG_PATH = png_path
+        self.H5_PATH = h5_path
 
-        if not os.path.exists(self.PNG_PATH) or not os.path.exists(self.H5_PATH):
-            print("❌ Нет PNG/H5")
+        if not os.path.exists(self.H5_PATH):
+            print("❌ Нет H5")
             sys.exit()
 
         pygame.init()
@@ -103,14 +466,40 @@ class Game:
         pygame.display.set_caption("Chunk + World Map with IDs")
         self.clock = pygame.time.Clock()
 
-        # Глобальная карта
-        self.image_original = pygame.image.load(self.PNG_PATH).convert()
-        self.image_original = pygame.transform.scale(self.image_original, (self.MAP_SIZE, self.MAP_SIZE))
-
-        # HDF5
-        self.h5 = h5py.File(self.H5_PATH, "r")
-        self.biome = self.h5["biome"]
+        # HDF5 (схема v1 или v2 определяется автоматически)
+        self.h5 = WorldFile(self.H5_PATH)
         self.height = self.h5["height"]
+        self.MAP_H, self.MAP_W = self.h5.shape
+        self.detail = ChunkDetailGenerator.from_world_file(self.h5, chunk_size=CHUNK_SIZE)
+        # Сохранённые чанки привязаны к миру: новый экспорт в тот же файл получает
+        # новый world_id и не видит чанков прежнего мира
+        use_chunk_cache(ChunkCache(chunk_directory(self.H5_PATH, self.h5.world_id), world=self.h5))
+        # Готовая пачка чанков будит игровой цикл событием (post потокобезопасен)
+        self.loader = ChunkLoader(self.detail, on_loaded=lambda keys: pygame.event.post(
+            pygame.event.Event(CHUNK_LOADED, keys=keys)))
+
+        # Глобальная карта: тайлы пирамиды из HDF5 (или PNG для файлов без пирамиды)
+        if self.h5.pyramid_levels == 0 and not os.path.exists(self.PNG_PATH):
+            print("❌ Нет пирамиды в H5 и нет PNG")
+            sys.exit()
+        self.map_tiles = MapTiles(self.h5, self.PNG_PATH)
+        self.map_zoom = None     # пикселей экрана на клетку мира; None — вписать при первой отрисовке
+        self.map_view = [0.0, 0.0]  # мировые координаты левого верхнего угла панели
+        self._map_drag = None
+
+        # Кэш отрисовки: пересобирается только при правке, смене чанка или вида карты
+        self._chunk_surface = None
+        self._chunk_surface_src = None
+        self._map_surface = None
+        self._map_surface_key = None
+
+        # Цикл перерисовывает кадр только при изменении вида (_redraw)
+        self._redraw = True
+        self._layout = None      # (размер окна, левая панель, правая панель)
+        self._hover = None       # клетка карты под мышью
+        self.frame_stats = FrameStats(log_path=frame_log)
+        self.show_overlay = False
+        self._font = None
 
         # Текущий чанк
         self.chunk_pos = (0,0)
@@ -125,10 +514,9 @@ class Game:
 
     # --------------------
     def load_chunk(self, pos):
-        x, y = pos
-        raw_biome = self.biome[y%self.MAP_SIZE, x%self.MAP_SIZE]
-        biome_name = raw_biome.decode("utf-8") if isinstance(raw_biome, bytes) else str(raw_biome)
-        self.chunk_data = generate_chunk(x, y, biome_name)
+        # Запрос уходит в фоновый поток; до готовности рисуется заглушка
+        self.loader.focus(pos)
+        self.chunk_data = self.loader.get(pos)
 
     # --------------------
     def move_player(self, dx, dy):
@@ -148,103 +536,313 @@ class Game:
 
     # --------------------
     def place_tree(self):
+        if self.chunk_data is None:
+            return
         self.chunk_data["objects"][self.player_y,self.player_x] = 1  # tree
+        chunk_cache.mark_dirty(self.chunk_pos, self.chunk_data)
+        self._chunk_surface = None
 
     def cut_tree(self):
+        if self.chunk_data is None:
+            return
         self.chunk_data["objects"][self.player_y,self.player_x] = 0  # empty
+        chunk_cache.mark_dirty(self.chunk_pos, self.chunk_data)
+        self._chunk_surface = None
 
     def inspect_cell(self):
+        if self.chunk_data is None:
+            print("Чанк ещё загружается")
+            return
         gx, gy = self.chunk_pos
         g_id = self.chunk_data["ground"][self.player_y, self.player_x]
         o_id = self.chunk_data["objects"][self.player_y, self.player_x]
         print(f"Чанк {gx},{gy} | Игрок: {self.player_x},{self.player_y}")
         print(f"Ground ID: {g_id} ({GROUND_ID[g_id]}) | Object ID: {o_id} ({OBJECT_ID[o_id]})")
+        if "height" in self.chunk_data:
+            print(f"Высота: {self.chunk_data['height'][self.player_y, self.player_x]:.1f}")
 
     # --------------------
     def draw_chunk(self, rect):
-        surf = pygame.Surface((CHUNK_SIZE, CHUNK_SIZE))
-        ground = self.chunk_data["ground"]
-        objects = self.chunk_data["objects"]
-
-        for y in range(CHUNK_SIZE):
-            for x in range(CHUNK_SIZE):
-                color = GROUND_COLORS[ground[y,x]]
-                obj_id = objects[y,x]
-                if obj_id !=0:
-                    color = OBJECT_COLORS[obj_id]
-                surf.set_at((x,y), color)
+        if self.chunk_data is None:
+            # Заглушка, пока чанк не готов
+            self.screen.fill((40,40,40), rect)
+            return
+
+        if (self._chunk_surface is None or self._chunk_surface_src is not self.chunk_data
+                or self._chunk_surface.get_size() != rect.size):
+            self._chunk_surface = pygame.transform.scale(chunk_surface(self.chunk_data), rect.size)
+            self._chunk_surface_src = self.chunk_data
+        self.screen.blit(self._chunk_surface, rect.topleft)
+
+        # игрок: та же клетка, что дал бы scale поверх set_at
+        x0 = self.player_x*rect.width//CHUNK_SIZE
+        x1 = (self.player_x+1)*rect.width//CHUNK_SIZE
+        y0 = self.player_y*rect.height//CHUNK_SIZE
+        y1 = (self.player_y+1)*rect.height//CHUNK_SIZE
+        self.screen.fill((255,0,0), pygame.Rect(rect.x+x0, rect.y+y0, max(1,x1-x0), max(1,y1-y0)))
 
-        surf.set_at((self.player_x,self.player_y),(255,0,0))  # игрок
-
-        surf = pygame.transform.scale(surf,(rect.width, rect.height))
-        self.screen.blit(surf, rect.topleft)
+    # --------------------
+    def map_fit(self, rect):
+        self.map_zoom = min(rect.width/self.MAP_W, rect.height/self.MAP_H)
+        self.map_view = [(self.MAP_W - rect.width/self.map_zoom)/2, (self.MAP_H - rect.height/self.map_zoom)/2]
+
+    def map_layout(self, rect):
+        if self.map_zoom is None:
+            self.map_fit(rect)
+        return self.map_zoom, rect.x - self.map_view[0]*self.map_zoom, rect.y - self.map_view[1]*self.map_zoom
+
+    def map_cell_at(self, rect, pos):
+        scale, offset_x, offset_y = self.map_layout(rect)
+        mx, my = pos
+        return int(math.floor((mx - offset_x)/scale)), int(math.floor((my - offset_y)/scale))
+
+    def zoom_map(self, rect, pos, factor):
+        # Масштаб вокруг точки под курсором
+        scale, offset_x, offset_y = self.map_layout(rect)
+        fit = min(rect.width/self.MAP_W, rect.height/self.MAP_H)
+        new_scale = min(max(scale*factor, fit/2), MAP_MAX_ZOOM)
+        wx = (pos[0] - offset_x)/scale
+        wy = (pos[1] - offset_y)/scale
+        self.map_zoom = new_scale
+        self.map_view = [wx - (pos[0] - rect.x)/new_scale, wy - (pos[1] - rect.y)/new_scale]
+
+    def pan_map(self, dx, dy):
+        # Сдвиг в пикселях экрана
+        self.map_view[0] -= dx/self.map_zoom
+        self.map_view[1] -= dy/self.map_zoom
+
+    def map_level(self, scale):
+        # Самый мелкий уровень, у которого пиксель не меньше пикселя экрана
+        level = int(math.floor(math.log2(1/scale))) if scale < 1 else 0
+        return min(max(level, 0), self.map_tiles.levels - 1)
+
+    def build_map_surface(self, rect):
+        scale, offset_x, offset_y = self.map_layout(rect)
+        surface = pygame.Surface(rect.size)
+        surface.fill((0,0,0))
+
+        level = self.map_level(scale)
+        step = 2**level
+        level_h, level_w = self.map_tiles.shape(level)
+        tile = self.map_tiles.tile
+        # Видимые пиксели уровня
+        vx0 = max(0, int(math.floor(self.map_view[0]/step)))
+        vy0 = max(0, int(math.floor(self.map_view[1]/step)))
+        vx1 = min(level_w, int(math.ceil((self.map_view[0] + rect.width/scale)/step)))
+        vy1 = min(level_h, int(math.ceil((self.map_view[1] + rect.height/scale)/step)))
+
+        for ty in range(vy0//tile, (vy1 - 1)//tile + 1 if vy1 > vy0 else 0):
+            for tx in range(vx0//tile, (vx1 - 1)//tile + 1 if vx1 > vx0 else 0):
+                # Видимая часть тайла в пикселях уровня
+                px0, px1 = max(vx0, tx*tile), min(vx1, (tx+1)*tile)
+                py0, py1 = max(vy0, ty*tile), min(vy1, (ty+1)*tile)
+                part = self.map_tiles.get(level, ty, tx).subsurface(
+                    pygame.Rect(px0 - tx*tile, py0 - ty*tile, px1 - px0, py1 - py0))
+                # Края считаются от мировых координат, чтобы соседние тайлы стыковались без щелей
+                sx0 = round(offset_x + px0*step*scale) - rect.x
+                sx1 = round(offset_x + min(px1*step, self.MAP_W)*scale) - rect.x
+                sy0 = round(offset_y + py0*step*scale) - rect.y
+                sy1 = round(offset_y + min(py1*step, self.MAP_H)*scale) - rect.y
+                if sx1 > sx0 and sy1 > sy0:
+                    surface.blit(pygame.transform.scale(part, (sx1 - sx0, sy1 - sy0)), (sx0, sy0))
+        return surface
+
+    def draw_world_map(self, rect):
+        scale, offset_x, offset_y = self.map_layout(rect)
+
+        key = (rect.size, scale, tuple(self.map_view))
+        if self._map_surface is None or self._map_surface_key != key:
+            self._map_surface = self.build_map_surface(rect)
+            self._map_surface_key = key
+        self.screen.blit(self._map_surface, rect.topleft)
+
+        size = max(1, int(scale))
+        # подсветка под мышью (клетка считается при движении мыши, см. hover_map)
+        if self._hover is not None:
+            map_x, map_y = self._hover
+            self.screen.fill((255,0,255), pygame.Rect(int(offset_x+map_x*scale), int(offset_y+map_y*scale), size, size))
+
+        # подсветка текущего чанка игрока (координаты чанков замкнуты, как в ChunkDetailGenerator)
+        cx, cy = self.chunk_pos[0] % self.MAP_W, self.chunk_pos[1] % self.MAP_H
+        self.screen.fill((200,0,200), pygame.Rect(int(offset_x+cx*scale), int(offset_y+cy*scale), size, size).clip(rect))
 
     # --------------------
-    def draw_world_map(self, rect, mouse_pos):
-        scale = min(rect.width, rect.height)/self.MAP_SIZE
-        disp_size = int(self.MAP_SIZE*scale)
-        offset_x = rect.x + (rect.width - disp_size)//2
-        offset_y = rect.y + (rect.height - disp_size)//2
-
-        image_scaled = pygame.transform.scale(self.image_original, (disp_size, disp_size))
-        self.screen.blit(image_scaled,(offset_x, offset_y))
-
-        # подсветка под мышью
-        mx, my = mouse_pos
-        map_x = int((mx - offset_x)/scale)
-        map_y = int((my - offset_y)/scale)
-        if 0<=map_x<self.MAP_SIZE and 0<=map_y<self.MAP_SIZE:
-            size_mouse = max(1,int(scale))
-            highlight_mouse = pygame.Surface((size_mouse,size_mouse))
-            highlight_mouse.fill((255,0,255))
-            self.screen.blit(highlight_mouse,(offset_x+int(map_x*scale), offset_y+int(map_y*scale)))
-
-        # подсветка текущего чанка игрока
-        cx, cy = self.chunk_pos
-        size_chunk = max(1,int(scale))
-        highlight_chunk = pygame.Surface((size_chunk,size_chunk))
-        highlight_chunk.fill((200,0,200))
-        self.screen.blit(highlight_chunk,(offset_x+int(cx*scale), offset_y+int(cy*scale)))
-
-        return map_x, map_y
+    def panels(self):
+        # Прямоугольники панелей пересчитываются только при смене размера окна
+        size = self.screen.get_size()
+        if self._layout is None or self._layout[0] != size:
+            win_w, win_h = size
+            self._layout = (size, pygame.Rect(0,0,win_w//2,win_h), pygame.Rect(win_w//2,0,win_w//2,win_h))
+        return self._layout[1], self._layout[2]
+
+    def map_hit(self, pos):
+        """Клетка карты под точкой экрана или None (хит-тест по кэшу панелей)."""
+        right_rect = self.panels()[1]
+        if not right_rect.collidepoint(pos):
+            return None
+        map_x, map_y = self.map_cell_at(right_rect, pos)
+        if 0<=map_x<self.MAP_W and 0<=map_y<self.MAP_H:
+            return map_x, map_y
+        return None
+
+    def hover_map(self, pos):
+        hover = self.map_hit(pos)
+        if hover != self._hover:
+            self._hover = hover
+            self._redraw = True
 
     # --------------------
-    def run(self):
-        running = True
-        while running:
-            win_w, win_h = self.screen.get_size()
-            left_rect = pygame.Rect(0,0,win_w//2,win_h)
-            right_rect = pygame.Rect(win_w//2,0,win_w//2,win_h)
+    def handle_event(self, event):
+        """Обработка события; выставляет _redraw, если вид изменился."""
+        left_rect, right_rect = self.panels()
+        redraw = True
+        if event.type==pygame.QUIT:
+            self.running=False
+        elif event.type==pygame.VIDEORESIZE:
+            self.screen = pygame.display.set_mode((event.w,event.h),pygame.RESIZABLE)
+        elif event.type==CHUNK_LOADED:
+            redraw = self.chunk_data is None and self.chunk_pos in event.keys
+            if redraw:
+                self.chunk_data = self.loader.get(self.chunk_pos)
+            # Кольцо предзагрузки не видно, но оверлей показывает кэш
+            redraw = redraw or self.show_overlay
+        elif event.type==pygame.KEYDOWN:
+            if event.key==pygame.K_w: self.move_player(0,-1)
+            elif event.key==pygame.K_s: self.move_player(0,1)
+            elif event.key==pygame.K_a: self.move_player(-1,0)
+            elif event.key==pygame.K_d: self.move_player(1,0)
+            elif event.key==pygame.K_f: self.place_tree()
+            elif event.key==pygame.K_x: self.cut_tree()
+            elif event.key==pygame.K_z:
+                self.inspect_cell()
+                redraw = False
+            elif event.key==pygame.K_EQUALS: self.zoom_map(right_rect, right_rect.center, MAP_ZOOM_STEP)
+            elif event.key==pygame.K_MINUS: self.zoom_map(right_rect, right_rect.center, 1/MAP_ZOOM_STEP)
+            elif event.key==pygame.K_LEFT: self.pan_map(MAP_PAN_STEP, 0)
+            elif event.key==pygame.K_RIGHT: self.pan_map(-MAP_PAN_STEP, 0)
+            elif event.key==pygame.K_UP: self.pan_map(0, MAP_PAN_STEP)
+            elif event.key==pygame.K_DOWN: self.pan_map(0, -MAP_PAN_STEP)
+            elif event.key==pygame.K_HOME: self.map_fit(right_rect)
+            elif event.key==pygame.K_F3: self.show_overlay = not self.show_overlay
+            else: redraw = False
+        elif event.type==pygame.MOUSEWHEEL:
             mouse_pos = pygame.mouse.get_pos()
+            redraw = right_rect.collidepoint(mouse_pos)
+            if redraw:
+                self.zoom_map(right_rect, mouse_pos, MAP_ZOOM_STEP**event.y)
+                self._hover = self.map_hit(mouse_pos)
+        elif event.type==pygame.MOUSEBUTTONDOWN and event.button==1:
+            hit = self.map_hit(event.pos)
+            redraw = hit is not None
+            if redraw:
+                self.chunk_pos = hit
+                self.player_x = CHUNK_SIZE//2
+                self.player_y = CHUNK_SIZE//2
+                self.load_chunk(self.chunk_pos)
+        elif event.type==pygame.MOUSEBUTTONDOWN and event.button in (2, 3):
+            self._map_drag = event.pos
+            redraw = False
+        elif event.type==pygame.MOUSEBUTTONUP and event.button in (2, 3):
+            self._map_drag = None
+            redraw = False
+        elif event.type==pygame.MOUSEMOTION:
+            redraw = False
+            if self._map_drag is not None:
+                self.pan_map(event.pos[0] - self._map_drag[0], event.pos[1] - self._map_drag[1])
+                self._map_drag = event.pos
+                redraw = True
+            self.hover_map(event.pos)
+        elif event.type in (pygame.WINDOWEXPOSED, pygame.WINDOWSIZECHANGED, pygame.WINDOWRESTORED):
+            pass
+        elif event.type==pygame.WINDOWLEAVE:
+            redraw = self._hover is not None
+            self._hover = None
+        else:
+            redraw = False
+        if redraw:
+            self._redraw = True
 
-            for event in pygame.event.get():
-                if event.type==pygame.QUIT:
-                    running=False
-                elif event.type==pygame.VIDEORESIZE:
-                    self.screen = pygame.display.set_mode((event.w,event.h),pygame.RESIZABLE)
-                elif event.type==pygame.KEYDOWN:
-                    if event.key==pygame.K_w: self.move_player(0,-1)
-                    elif event.key==pygame.K_s: self.move_player(0,1)
-                    elif event.key==pygame.K_a: self.move_player(-1,0)
-                    elif event.key==pygame.K_d: self.move_player(1,0)
-                    elif event.key==pygame.K_f: self.place_tree()
-                    elif event.key==pygame.K_x: self.cut_tree()
-                    elif event.key==pygame.K_z: self.inspect_cell()
-                elif event.type==pygame.MOUSEBUTTONDOWN:
-                    map_x, map_y = self.draw_world_map(right_rect, mouse_pos)
-                    if 0<=map_x<self.MAP_SIZE and 0<=map_y<self.MAP_SIZE:
-                        self.chunk_pos = (map_x, map_y)
-                        self.player_x = CHUNK_SIZE//2
-                        self.player_y = CHUNK_SIZE//2
-                        self.load_chunk(self.chunk_pos)
-
-            self.screen.fill((0,0,0))
-            self.draw_chunk(left_rect)
-            self.draw_world_map(right_rect, mouse_pos)
+    # --------------------
+    def draw_overlay(self):
+        if self._font is None:
+            self._font = pygame.font.Font(None, 20)
+        stats = self.frame_stats.summary()
+        cache = chunk_cache.stats()
+        lines = [f"frames {stats['frames']}  wakeups {stats['wakeups']}  (F3)"]
+        if "p50_ms" in stats:
+            lines.append(f"frame ms  p50 {stats['p50_ms']:.1f}  p95 {stats['p95_ms']:.1f}  "
+                         f"p99 {stats['p99_ms']:.1f}  max {stats['max_ms']:.1f}")
+            lines.append(f"mean ms  update {stats['update_ms']:.2f}  draw {stats['draw_ms']:.2f}  io {stats['io_ms']:.2f}")
+        lines.append(f"chunks {cache['chunks']} ({cache['bytes']/2**20:.1f} MiB)  dirty {cache['dirty']}  "
+                     f"unwritten {cache['pending_writes']}  pending {self.loader.pending}")
+        lines.append(f"hits {cache['hits']}  misses {cache['misses']}  disk {cache['disk_loads']}  "
+                     f"writes {cache['writes']}  evicted {cache['evictions']}")
+        lines.append(f"map tiles {len(self.map_tiles._tiles)}/{self.map_tiles.max_tiles}  reads {self.map_tiles.reads}")
+
+        surfaces = [self._font.render(line, True, (255,255,255)) for line in lines]
+        panel = pygame.Surface((max(t.get_width() for t in surfaces) + 12, sum(t.get_height() for t in surfaces) + 12))
+        panel.set_alpha(190)
+        panel.fill((0,0,0))
+        y = 6
+        for text in surfaces:
+            panel.blit(text, (6, y))
+            y += text.get_height()
+        self.screen.blit(panel, (8, 8))
+
+    def draw(self):
+        left_rect, right_rect = self.panels()
+        self.screen.fill((0,0,0))
+        self.draw_chunk(left_rect)
+        self.draw_world_map(right_rect)
+        if self.show_overlay:
+            self.draw_overlay()
 
+    # --------------------
+    def run(self):
+        """
+        Кадр рисуется только при изменении вида: ввод, готовый чанк, смена
+        размера или открытие окна. В простое цикл спит в pygame.event.wait.
+        """
+        self.running = True
+        reason = "start"
+        while self.running:
+            if not self._redraw:
+                first = pygame.event.wait(IDLE_WAIT_MS)
+                events = [first] if first.type != pygame.NOEVENT else []
+            else:
+                events = []
+            self.frame_stats.wakeups += 1
+
+            start = time.perf_counter()
+            events += pygame.event.get()
+            for event in events:
+                self.handle_event(event)
+                if self._redraw and reason is None:
+                    reason = "chunk_loaded" if event.type == CHUNK_LOADED else pygame.event.event_name(event.type)
+
+            # Запасной опрос на случай потерянного события загрузки
+            if self.chunk_data is None:
+                self.chunk_data = self.loader.get(self.chunk_pos)
+                if self.chunk_data is not None:
+                    self._redraw = True
+                    reason = reason or "chunk"
+
+            if not self._redraw or not self.running:
+                continue
+            drawn = time.perf_counter()
+            io_before = self.map_tiles.read_seconds
+            self.draw()
             pygame.display.flip()
-            self.clock.tick(60)
-
+            done = time.perf_counter()
+            io = self.map_tiles.read_seconds - io_before
+            self.frame_stats.record(update=(drawn - start)*1000, draw=(done - drawn - io)*1000,
+                                    io=io*1000, reason=reason)
+            self._redraw = False
+            reason = None
+            self.clock.tick(MAX_FPS)
+
+        self.loader.stop()
+        chunk_cache.flush()
+        self.frame_stats.close(chunk_cache.stats())
         self.h5.close()
         pygame.quit()
-        sys.exit()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import os
+import sys
+import numpy as np
+from multiprocessing import Process, shared_memory
+from world import WorldGenerator
+
+# -----------------------------
+# Живой просмотр генерации через shared memory
+# -----------------------------
+# Родитель создаёт блоки shared memory под слои WorldGenerator и маленький
+# заголовок, фоновый процесс генерирует мир прямо в эти массивы (buffers=...)
+# и после каждой стадии обновляет заголовок. Окно просмотра смотрит на те же
+# массивы без копий и файлов и перерисовывается, когда растёт версия.
+#
+# Заголовок — int64[8]: MAGIC, ширина, высота, номер стадии в LIVE_STAGES,
+# версия (растёт после каждой стадии), статус.
+MAGIC = 0x574f524c44  # "WORLD"
+LIVE_STAGES = ["start", "tectonics", "create_base_world", "detect_boundaries", "apply_terrain", "assign_biomes"]
+RUNNING, DONE, FAILED = 0, 1, 2
+H_MAGIC, H_WIDTH, H_HEIGHT, H_STAGE, H_VERSION, H_STATUS = range(6)
+
+# Слои, которые видит окно просмотра
+LIVE_LAYERS = ["plate_id", "height", "biome", "color"]
+
+
+class SharedWorld:
+    """
+    Слои мира и заголовок в multiprocessing.shared_memory.
+    create=True — владелец (создаёт и в конце удаляет блоки), иначе подключение по prefix.
+    """
+    def __init__(self, prefix, width, height, create=False, compact=False):
+        self.prefix = prefix
+        self.owner = create
+        self._blocks = []
+        self.header = self._array("header", (8,), np.int64, create)
+        self.layers = {}
+        # dtype слоёв — как у WorldGenerator(compact=compact), иначе buffers не подойдут
+        for name, shape, dtype, _ in WorldGenerator.layer_specs(width, height, compact):
+            if name in LIVE_LAYERS:
+                self.layers[name] = self._array(name, shape, dtype, create)
+        if create:
+            self.header[:] = 0
+            self.header[H_WIDTH], self.header[H_HEIGHT] = width, height
+            self.header[H_MAGIC] = MAGIC
+
+    def _array(self, name, shape, dtype, create):
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        block = shared_memory.SharedMemory(name=f"{self.prefix}_{name}", create=create, size=size)
+        self._blocks.append(block)
+        return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    @property
+    def stage(self):
+        return LIVE_STAGES[self.header[H_STAGE]]
+
+    @property
+    def version(self):
+        return int(self.header[H_VERSION])
+
+    @property
+    def status(self):
+        return int(self.header[H_STATUS])
+
+    def publish(self, stage):
+        # Сначала стадия, потом версия: читатель, увидевший новую версию, видит и стадию
+        self.header[H_STAGE] = LIVE_STAGES.index(stage)
+        self.header[H_VERSION] += 1
+
+    def finish(self, status=DONE):
+        self.header[H_STATUS] = status
+        self.header[H_VERSION] += 1
+
+    def close(self):
+        self.layers.clear()
+        self.header = None
+        for block in self._blocks:
+            block.close()
+            if self.owner:
+                block.unlink()
+        self._blocks = []
+
+
+def _generate_live(prefix, compact, params):
+    shared = SharedWorld(prefix, params["width"], params["height"], compact=compact)
+    try:
+        from pipeline import run
+        run(buffers=shared.layers, on_stage=shared.publish, **dict(params, compact=compact))
+        shared.finish(DONE)
+    except BaseException:
+        shared.finish(FAILED)
+        raise
+    finally:
+        shared.close()
+
+
+def start_live(prefix=None, **params):
+    """
+    Запускает pipeline.run(**params) в фоновом процессе: параметры generate_world
+    плюс cache_dir, trace_path, profile_dir.
+    Возвращает (SharedWorld владельца, Process).
+    """
+    from pipeline import resolve_compact
+    prefix = prefix or f"world_{os.getpid()}"
+    # compact решается здесь: под него выделяются блоки shared memory
+    compact = resolve_compact(params["width"], params["height"], params.get("compact", False),
+                              params.get("memory_budget"), warn=False)
+    shared = SharedWorld(prefix, params["width"], params["height"], create=True, compact=compact)
+    process = Process(target=_generate_live, args=(prefix, compact, params), daemon=True)
+    process.start()
+    return shared, process
+
+
+# -----------------------------
+# Окно просмотра
+# -----------------------------
+PLATE_PALETTE = np.random.default_rng(0).integers(40, 255, size=(4096, 3), dtype=np.uint8)
+
+
+def preview_rgb(shared):
+    """(W, H, 3) картинка лучшего на текущей стадии слоя (в порядке surfarray)."""
+    stage = shared.stage
+    layers = shared.layers
+    if stage == "assign_biomes":
+        rgb = layers["color"]
+    elif stage == "apply_terrain":
+        height = layers["height"]
+        gray = np.clip((height + 4000) * (255 / 10000), 0, 255).astype(np.uint8)
+        rgb = np.repeat(gray[..., None], 3, axis=2)
+        rgb[height < 0, :2] //= 3
+    elif stage in ("create_base_world", "detect_boundaries"):
+        rgb = PLATE_PALETTE[layers["plate_id"] % len(PLATE_PALETTE)]
+    else:
+        rgb = np.zeros(layers["color"].shape, dtype=np.uint8)
+    return rgb.transpose(1, 0, 2)
+
+
+def run_preview(shared, process=None, window_size=(900, 600)):
+    """Окно, которое перерисовывается при смене стадии или размера; закрывается пользователем."""
+    import pygame
+    pygame.init()
+    screen = pygame.display.set_mode(window_size, pygame.RESIZABLE)
+    clock = pygame.time.Clock()
+    shown_version = None
+    dirty = True
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.VIDEORESIZE:
+                screen = pygame.display.set_mode((event.w, event.h), pygame.RESIZABLE)
+                dirty = True
+
+        version = shared.version
+        if version != shown_version or dirty:
+            shown_version = version
+            dirty = False
+            image = pygame.surfarray.make_surface(preview_rgb(shared))
+            win_w, win_h = screen.get_size()
+            w, h = image.get_size()
+            scale = min(win_w / w, win_h / h)
+            image = pygame.transform.scale(image, (max(1, int(w * scale)), max(1, int(h * scale))))
+            screen.fill((0, 0, 0))
+            screen.blit(image, ((win_w - image.get_width()) // 2, (win_h - image.get_height()) // 2))
+            status = {RUNNING: "…", DONE: "готово", FAILED: "ошибка"}[shared.status]
+            pygame.display.set_caption(f"Генерация: {shared.stage} {status}")
+            pygame.display.flip()
+        clock.tick(30)
+
+    pygame.quit()
+    if process is not None:
+        process.join()
+    return shared.status
+
+
+def generate_live(**params):
+    """Генерация в фоне с живым окном; возвращает статус DONE/FAILED."""
+    shared, process = start_live(**params)
+    try:
+        status = run_preview(shared, process)
+    finally:
+        shared.close()
+    if status == FAILED:
+        print("❌ Генерация завершилась с ошибкой", file=sys.stderr)
+    return status
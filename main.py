@@ -1,38 +1,86 @@
-from tectonics import TectonicsGenerator
-from world import WorldGenerator
-from interact import Game
+import argparse
+import os
 
-def generate():
-    WIDTH = 64
-    HEIGHT = 64
-    PLATES_COUNT = 12
 
+def generate(width=64, height=64, plates_count=12, seed=None, h5_path="world_data.h5",
+             png_path="world_map_gradient.png", heightmap_path=None, steps=3, show_plates=False,
+             trace_path=None, profile_dir=None, cache_dir=None, compact=False, memory_budget=None,
+             live=False):
     # ------------------------------
-    # Генерация тектоники
+    # Тектоника -> мир -> экспорт
+    # trace_path/profile_dir: Chrome-trace и cProfile по стадиям
+    # cache_dir: кэш результатов стадий (только с seed)
+    # compact/memory_budget: float32/int16 слои и бюджет памяти в байтах
+    # live: генерация в фоновом процессе с окном просмотра (без show_plates)
     # ------------------------------
-    tectonics_gen = TectonicsGenerator(width=WIDTH, height=HEIGHT, plates_count=PLATES_COUNT)
-    plate_map, plates = tectonics_gen.generate()
-    tectonics_gen.visualize()
+    params = dict(width=width, height=height, plates_count=plates_count, seed=seed,
+                  h5_path=h5_path, png_path=png_path, heightmap_path=heightmap_path,
+                  steps=steps, compact=compact, memory_budget=memory_budget,
+                  cache_dir=cache_dir, trace_path=trace_path, profile_dir=profile_dir)
+    if live:
+        from livepreview import generate_live
+        return generate_live(**params)
+    from pipeline import run
+    return run(visualize=show_plates, **params)
 
-    # ------------------------------
-    # Генерация мира
-    # ------------------------------
-    world_gen = WorldGenerator(width=WIDTH, height=HEIGHT, plate_map=plate_map, plates=plates)
-    world_gen.create_base_world()
-    world_gen.detect_boundaries()
-    world_gen.apply_terrain()
-    world_gen.assign_biomes()
 
-    # ------------------------------
-    # Экспорт
-    # ------------------------------
-    world_gen.export_hdf5("world_data.h5")
-    world_gen.export_png("world_map_gradient.png")
-    # world_gen.export_heightmap_png("heightmap.png")
+def play(h5_path="world_data.h5", png_path="world_map_gradient.png", frame_log=None):
+    from interact import Game
+    Game(h5_path=h5_path, png_path=png_path, frame_log=frame_log)
 
-if __name__ == "__main__":
-    if input("Generate world? (y/n)").lower() == "y":
-        generate()
-        Game()
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Генерация мира и просмотр")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="сгенерировать мир и экспортировать HDF5/PNG")
+    gen.add_argument("--width", type=int, default=64)
+    gen.add_argument("--height", type=int, default=64)
+    gen.add_argument("--plates", type=int, default=12, help="число тектонических плит")
+    gen.add_argument("--seed", type=int, default=None)
+    gen.add_argument("--steps", type=int, default=3, help="шаги смешивания цветов биомов в PNG")
+    gen.add_argument("--h5", default="world_data.h5", help="выходной HDF5")
+    gen.add_argument("--png", default="world_map_gradient.png", help="выходной PNG (пустая строка — пропустить)")
+    gen.add_argument("--heightmap", default=None, help="PNG карты высот")
+    gen.add_argument("--compact", action="store_true", help="float32/int16 слои: меньше памяти")
+    gen.add_argument("--memory-budget", type=float, default=None, help="бюджет памяти, МиБ (включает --compact при нехватке)")
+    gen.add_argument("--cache-dir", default=None, help="кэш результатов стадий (нужен --seed)")
+    gen.add_argument("--trace", default=None, help="Chrome-trace JSON по стадиям")
+    gen.add_argument("--profile-dir", default=None, help="cProfile стадий (*.prof)")
+    gen.add_argument("--show-plates", action="store_true", help="показать карту плит (matplotlib)")
+    gen.add_argument("--headless", action="store_true", help="без окон: никаких GUI-бэкендов")
+    gen.add_argument("--live", action="store_true", help="генерировать в фоне с живым окном просмотра")
+    gen.add_argument("--play", action="store_true", help="открыть мир в игре после генерации")
+
+    pl = sub.add_parser("play", help="открыть сгенерированный мир")
+    pl.add_argument("--h5", default="world_data.h5")
+    pl.add_argument("--png", default="world_map_gradient.png")
+    pl.add_argument("--frame-log", default=None, help="время кадров и статистика кэша чанков (JSON-строки)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.command == "generate":
+        if args.headless:
+            os.environ.setdefault("MPLBACKEND", "Agg")
+            args.show_plates = False
+            args.play = False
+            args.live = False
+        if args.live and args.show_plates:
+            parser.error("--show-plates cannot be combined with --live (the live window shows plates)")
+        generate(width=args.width, height=args.height, plates_count=args.plates, seed=args.seed,
+                 h5_path=args.h5 or None, png_path=args.png or None, heightmap_path=args.heightmap,
+                 steps=args.steps, show_plates=args.show_plates, trace_path=args.trace,
+                 profile_dir=args.profile_dir, cache_dir=args.cache_dir, compact=args.compact,
+                 memory_budget=args.memory_budget * 2**20 if args.memory_budget else None, live=args.live)
+        if args.play and args.h5:
+            play(h5_path=args.h5, png_path=args.png)
     else:
-        Game()
\ No newline at end of file
+        play(h5_path=args.h5, png_path=args.png, frame_log=args.frame_log)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,100 @@
 import numpy as np
-import matplotlib.pyplot as plt
+
+BLEND_BAND_CELLS = 1 << 15  # клеток в полосе шагов смешивания (~1.3 МиБ на массив сумм)
+# Таблицы сумм целые (вес в единицах 2^-20): сумма по окну точна и не зависит
+# от того, где начинается карта, — тайлы и патчи окон совпадают с целой картой.
+# cumsum в int64 может переполниться на огромных картах, но разность по окну
+# считается по модулю 2^64 и остаётся точной, пока сама влезает в int64.
+BLEND_FIXED_POINT = 1 << 20
 
 class MapVisualizer:
     @staticmethod
-    def blend_biomes(world, steps=3):
-        HEIGHT = len(world)
-        WIDTH = len(world[0])
-        base_colors = np.zeros((HEIGHT, WIDTH, 3), dtype=np.float32)
-        heights = np.zeros((HEIGHT, WIDTH), dtype=np.float32)
-
-        for y in range(HEIGHT):
-            for x in range(WIDTH):
-                base_colors[y, x] = np.array(world[y][x].color, dtype=np.float32)
-                heights[y, x] = world[y][x].height
-
-        img = base_colors.copy()
-
-        for step in range(1, steps + 1):
-            temp = img.copy()
-            for y in range(HEIGHT):
-                for x in range(WIDTH):
-                    cell = world[y][x]
-                    neighbors = []
-                    weights = []
-
-                    for dy in range(-step, step + 1):
-                        for dx in range(-step, step + 1):
-                            ny, nx = y + dy, x + dx
-                            if 0 <= ny < HEIGHT and 0 <= nx < WIDTH and (ny != y or nx != x):
-                                neighbor_cell = world[ny][nx]
-                                # Вода и суша не смешиваем
-                                if (cell.tile_type in ["deep_ocean","shelf"] and neighbor_cell.tile_type not in ["deep_ocean","shelf"]):
-                                    continue
-                                if (cell.tile_type not in ["deep_ocean","shelf"] and neighbor_cell.tile_type in ["deep_ocean","shelf"]):
-                                    continue
-                                neighbors.append(neighbor_cell.color)
-                                weights.append(heights[ny,nx]+1e-3)
-
-                    if neighbors:
-                        neighbors = np.array(neighbors)
-                        weights = np.array(weights)
-                        weights /= (weights.sum()+1e-6)
-                        avg = np.sum(neighbors*weights[:,None], axis=0)
-                        factor = 0.5/step
-                        temp[y,x] = (1-factor)*img[y,x] + factor*avg
-
-            img = temp
-
-        return np.clip(img,0,255).astype(np.uint8)
+    def blend_biomes(colors, heights, water, steps=3):
+        """
+        colors: (H, W, 3) цвета биомов
+        heights: (H, W) высоты (вес соседа при смешивании)
+        water: (H, W) bool-маска воды; вода и суша не смешиваются
+
+        На шаге step каждая клетка смешивается со средним цветом соседей
+        в окне (2*step+1)^2 своего класса (вода/суша), взвешенным по высоте.
+        Суммы по окну берутся из таблиц сумм (summed-area) — четыре выборки на шаг.
+        """
+        weights = np.asarray(heights, dtype=np.float64) + 1e-3
+        weights *= BLEND_FIXED_POINT
+        np.rint(weights, out=weights)
+        water = np.asarray(water, dtype=bool)
+
+        # Каналы плоскостями (C, H, W): [клетка, вес, цвет*вес (3)] — вклад самой клетки
+        own = np.empty((5,) + weights.shape, dtype=np.int64)
+        own[0] = BLEND_FIXED_POINT
+        own[1] = weights
+        own[2:] = np.moveaxis(np.asarray(colors), -1, 0)
+        own[2:] *= own[1]
+        del weights
+        # Таблицы сумм по всем клеткам и по воде строятся один раз на все шаги;
+        # сумма суши по окну — разность двух
+        all_table = MapVisualizer._summed_area(own, steps)
+        water_table = MapVisualizer._summed_area(own * water, steps)
+        land = ~water
+
+        h, w = own.shape[1:]
+        out = np.empty((h, w, 3), dtype=np.uint8)
+        # Шаги смешивания не зависят от соседних строк img — считаются полосами,
+        # которые помещаются в кэш процессора
+        rows = max(1, BLEND_BAND_CELLS // w)
+        for y0 in range(0, h, rows):
+            y1 = min(h, y0 + rows)
+            img = np.moveaxis(np.asarray(colors[y0:y1]), -1, 0).astype(np.float32)
+            band_own = own[:, y0:y1]
+            band_land = land[y0:y1]
+            for step in range(1, steps + 1):
+                # Суммы по окну (2*step+1)^2 для класса клетки, без самой клетки
+                sums = MapVisualizer._window_sum(water_table, step, steps, y0, y1)
+                land_sums = MapVisualizer._window_sum(all_table, step, steps, y0, y1)
+                land_sums -= sums
+                np.copyto(sums, land_sums, where=band_land)
+                sums -= band_own
+                sums = sums / BLEND_FIXED_POINT
+                count, weight_sum, color_sum = sums[0], sums[1], sums[2:]
+
+                weight_sum += 1e-6
+                color_sum /= weight_sum
+                factor = 0.5/step
+                color_sum *= factor
+                blended = (1-factor)*img + color_sum
+                np.copyto(img, blended, where=count > 0.5)
+
+            np.clip(img, 0, 255, out=img)
+            out[y0:y1] = np.moveaxis(img, 0, -1)
+        return out
+
+    @staticmethod
+    def _summed_area(planes, pad):
+        # Таблица сумм (C, H+1, W+1) с полем pad повтором края: окно,
+        # вылезающее за карту, само обрезается по её границе
+        c, h, w = planes.shape
+        table = np.zeros((c, h + 1 + 2*pad, w + 1 + 2*pad), dtype=planes.dtype)
+        inner = table[:, pad + 1:pad + 1 + h, pad + 1:pad + 1 + w]
+        np.cumsum(planes, axis=1, out=inner)
+        np.cumsum(inner, axis=2, out=inner)
+        table[:, pad + 1:pad + 1 + h, pad + 1 + w:] = inner[:, :, -1:]
+        table[:, pad + 1 + h:, :] = table[:, pad + h:pad + h + 1, :]
+        return table
+
+    @staticmethod
+    def _window_sum(table, step, pad, y0, y1):
+        # Сумма по окну (2*step+1)^2 вокруг клеток строк y0:y1, с нулями за краем карты
+        w = table.shape[2] - 2*pad - 1
+        lo, hi = pad - step, pad + step + 1
+        sums = table[:, y0 + hi:y1 + hi, hi:hi + w] - table[:, y0 + lo:y1 + lo, hi:hi + w]
+        sums -= table[:, y0 + hi:y1 + hi, lo:lo + w]
+        sums += table[:, y0 + lo:y1 + lo, lo:lo + w]
+        return sums
 
     @staticmethod
-    def visualize(world, steps=3, filename=None):
-        img = MapVisualizer.blend_biomes(world, steps=steps)
+    def visualize(colors, heights, water, steps=3, filename=None):
+        import matplotlib.pyplot as plt
+        img = MapVisualizer.blend_biomes(colors, heights, water, steps=steps)
         plt.figure(figsize=(10,10))
         plt.imshow(img)
         plt.axis("off")
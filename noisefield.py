@@ -0,0 +1,158 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+import profiling
+
+# -----------------------------
+# Векторизованный Perlin-шум, совместимый с noise.pnoise2
+# (та же таблица перестановок, градиенты и арифметика во float32)
+# -----------------------------
+_PERM_256 = np.array([
+    151, 160, 137, 91, 90, 15, 131, 13, 201, 95, 96, 53, 194, 233, 7, 225,
+    140, 36, 103, 30, 69, 142, 8, 99, 37, 240, 21, 10, 23, 190, 6, 148,
+    247, 120, 234, 75, 0, 26, 197, 62, 94, 252, 219, 203, 117, 35, 11, 32,
+    57, 177, 33, 88, 237, 149, 56, 87, 174, 20, 125, 136, 171, 168, 68, 175,
+    74, 165, 71, 134, 139, 48, 27, 166, 77, 146, 158, 231, 83, 111, 229, 122,
+    60, 211, 133, 230, 220, 105, 92, 41, 55, 46, 245, 40, 244, 102, 143, 54,
+    65, 25, 63, 161, 1, 216, 80, 73, 209, 76, 132, 187, 208, 89, 18, 169,
+    200, 196, 135, 130, 116, 188, 159, 86, 164, 100, 109, 198, 173, 186, 3, 64,
+    52, 217, 226, 250, 124, 123, 5, 202, 38, 147, 118, 126, 255, 82, 85, 212,
+    207, 206, 59, 227, 47, 16, 58, 17, 182, 189, 28, 42, 223, 183, 170, 213,
+    119, 248, 152, 2, 44, 154, 163, 70, 221, 153, 101, 155, 167, 43, 172, 9,
+    129, 22, 39, 253, 19, 98, 108, 110, 79, 113, 224, 232, 178, 185, 112, 104,
+    218, 246, 97, 228, 251, 34, 242, 193, 238, 210, 144, 12, 191, 179, 162, 241,
+    81, 51, 145, 235, 249, 14, 239, 107, 49, 192, 214, 31, 181, 199, 106, 157,
+    184, 84, 204, 176, 115, 121, 50, 45, 127, 4, 150, 254, 138, 236, 205, 93,
+    222, 114, 67, 29, 24, 72, 243, 141, 128, 195, 78, 66, 215, 61, 156, 180,
+], dtype=np.int32)
+
+# Таблица повторена 4 раза: индексы вида PERM[PERM[i] + j + base] не выходят за край при base < 256
+PERM = np.tile(_PERM_256, 4)
+
+_GRAD_X = np.array([1,-1,1,-1, 1,-1,1,-1, 0,0,0,0, 1,-1,0,0], dtype=np.float32)
+_GRAD_Y = np.array([1,1,-1,-1, 0,0,0,0, 1,-1,1,-1, 0,0,-1,1], dtype=np.float32)
+
+# Градиент сразу по индексу в PERM: _PERM_GX[k] == _GRAD_X[PERM[k] & 15]
+_PERM_GX = _GRAD_X[PERM & 15]
+_PERM_GY = _GRAD_Y[PERM & 15]
+
+
+def _grad2(k, x, y):
+    return x * _PERM_GX.take(k) + y * _PERM_GY.take(k)
+
+
+def _lerp(t, a, b):
+    return a + t * (b - a)
+
+
+def _noise2(x, y, repeatx, repeaty, base):
+    i = np.floor(np.fmod(x, repeatx)).astype(np.int32)
+    j = np.floor(np.fmod(y, repeaty)).astype(np.int32)
+    ii = np.fmod((i + 1).astype(np.float32), repeatx).astype(np.int32)
+    jj = np.fmod((j + 1).astype(np.float32), repeaty).astype(np.int32)
+    i = (i & 255) + base
+    j = (j & 255) + base
+    ii = (ii & 255) + base
+    jj = (jj & 255) + base
+
+    x = x - np.floor(x)
+    y = y - np.floor(y)
+    fx = x*x*x * (x * (x * 6 - 15) + 10)
+    fy = y*y*y * (y * (y * 6 - 15) + 10)
+
+    A = PERM[i]
+    AA = PERM.take(A + j)
+    AB = PERM.take(A + jj)
+    B = PERM[ii]
+    BA = PERM.take(B + j)
+    BB = PERM.take(B + jj)
+
+    return _lerp(fy, _lerp(fx, _grad2(AA, x, y),
+                               _grad2(BA, x - 1, y)),
+                     _lerp(fx, _grad2(AB, x, y - 1),
+                               _grad2(BB, x - 1, y - 1)))
+
+
+def pnoise2(x, y, octaves=1, persistence=0.5, lacunarity=2.0, repeatx=1024.0, repeaty=1024.0, base=0):
+    """
+    Векторный аналог noise.pnoise2: x и y — массивы (с broadcasting).
+    Для сетки удобно передавать x формы (1, W) и y формы (H, 1):
+    всё, что зависит только от одной оси, тогда считается один раз.
+    """
+    if octaves < 1:
+        raise ValueError("Expected octaves value > 0")
+    x = np.asarray(x, dtype=np.float32)
+    y = np.asarray(y, dtype=np.float32)
+    profiling.count("noise_evaluations", int(np.prod(np.broadcast_shapes(x.shape, y.shape))))
+    repeatx = np.float32(repeatx)
+    repeaty = np.float32(repeaty)
+    base = int(base) % 256
+
+    if octaves == 1:
+        return _noise2(x, y, repeatx, repeaty, base)
+
+    persistence = np.float32(persistence)
+    lacunarity = np.float32(lacunarity)
+    freq = np.float32(1.0)
+    amp = np.float32(1.0)
+    max_amp = np.float32(0.0)
+    total = np.float32(0.0)
+    for _ in range(octaves):
+        total = total + _noise2(x * freq, y * freq, repeatx * freq, repeaty * freq, base) * amp
+        max_amp += amp
+        freq *= lacunarity
+        amp *= persistence
+    return total / max_amp
+
+
+# Потолок потоков noise_grid на процесс; воркеры пулов процессов ставят 1,
+# чтобы не плодить cpu_count² потоков
+MAX_WORKERS = None
+
+
+def noise_grid(xs, ys, octaves=1, persistence=0.5, lacunarity=2.0, seed=0, workers=None, tile=256):
+    """
+    Шум на сетке xs × ys (1-D координаты по осям), результат (len(ys), len(xs)) float32.
+    Большие сетки режутся на блоки tile×tile и считаются в пуле потоков
+    (numpy отпускает GIL на крупных операциях).
+    """
+    xs = np.asarray(xs, dtype=np.float32)
+    ys = np.asarray(ys, dtype=np.float32)
+    out = np.empty((ys.size, xs.size), dtype=np.float32)
+
+    blocks = [(y0, x0) for y0 in range(0, ys.size, tile) for x0 in range(0, xs.size, tile)]
+
+    def fill(block):
+        y0, x0 = block
+        bx = xs[x0:x0+tile]
+        by = ys[y0:y0+tile]
+        out[y0:y0+by.size, x0:x0+bx.size] = pnoise2(
+            bx[None, :], by[:, None], octaves=octaves, persistence=persistence,
+            lacunarity=lacunarity, base=seed)
+
+    if workers is None:
+        workers = min(len(blocks), MAX_WORKERS or os.cpu_count() or 1)
+    if workers <= 1:
+        for block in blocks:
+            fill(block)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(fill, blocks))
+    return out
+
+
+def noise_field(origin=(0, 0), size=(64, 64), scale=1.0, octaves=1, persistence=0.5, lacunarity=2.0,
+                seed=0, workers=None, tile=256):
+    """
+    Поле шума (H, W) float32, где пиксель (x, y) равен
+    noise.pnoise2((x0 + x)/scale, (y0 + y)/scale, octaves, persistence, lacunarity, base=seed).
+
+    origin: (x0, y0) — мировые координаты левого верхнего пикселя
+    size: (W, H)
+    """
+    x0, y0 = origin
+    width, height = size
+    xs = (x0 + np.arange(width)) / scale
+    ys = (y0 + np.arange(height)) / scale
+    return noise_grid(xs, ys, octaves=octaves, persistence=persistence, lacunarity=lacunarity,
+                      seed=seed, workers=workers, tile=tile)
@@ -0,0 +1,172 @@
+import os
+import profiling
+from profiling import Tracer
+from tectonics import TectonicsGenerator
+from world import WorldGenerator, BIOME_TABLE
+
+WORLD_STAGES = ["create_base_world", "detect_boundaries", "apply_terrain", "assign_biomes"]
+
+# Что сохраняет в кэш каждая стадия WorldGenerator (create_base_world дёшева и не кэшируется)
+CACHED_LAYERS = {
+    "detect_boundaries": ["is_boundary", "boundary_type"],
+    "apply_terrain": ["height"],
+    "assign_biomes": ["moisture", "biome", "color"],
+}
+
+
+# Пик роста плит (CSR-граф, Dijkstra, pointer jumping) на клетку; измерено по VmHWM на 2048²
+TECTONICS_BYTES_PER_TILE = 88
+
+
+def estimate_peak_bytes(width, height, compact=False):
+    """Оценка пикового прироста памяти generate_world без экспорта (байты)."""
+    return max(width * height * TECTONICS_BYTES_PER_TILE,
+               WorldGenerator.estimate_peak_bytes(width, height, compact))
+
+
+def available_memory():
+    """Доступная память (MemAvailable, байты) или None, если её не узнать."""
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _cached_stage(cache, name, params, upstream, compute, restore):
+    """
+    Выполняет стадию или восстанавливает её результат из StageCache.
+    Возвращает ключ стадии (upstream для следующей).
+    """
+    if cache is None:
+        compute()
+        return None
+    key = cache.key(name, params, upstream)
+    payload = cache.get(name, key)
+    if payload is None:
+        cache.put(name, key, compute())
+        profiling.count("cache_misses")
+    else:
+        restore(payload)
+        profiling.count("cache_hits")
+    return key
+
+
+def resolve_compact(width, height, compact=False, memory_budget=None, warn=True):
+    # compact включается сам, если обычный режим не влезает в memory_budget (байты)
+    if memory_budget is None:
+        return compact
+    compact = compact or estimate_peak_bytes(width, height) > memory_budget
+    need = estimate_peak_bytes(width, height, compact)
+    if warn and need > memory_budget:
+        print(f"[WARN] Estimated peak {need / 2**20:.0f} MiB exceeds memory budget {memory_budget / 2**20:.0f} MiB")
+    return compact
+
+
+def generate_world(width=64, height=64, plates_count=12, seed=None, h5_path="world_data.h5",
+                   png_path="world_map_gradient.png", heightmap_path=None, steps=3, visualize=False,
+                   cache=None, biome_table=BIOME_TABLE, buffers=None, on_stage=None, compact=False,
+                   memory_budget=None):
+    """
+    Полный конвейер: тектоника -> стадии WorldGenerator -> экспорт.
+    Каждая стадия обёрнута в profiling.stage и видна в активном Tracer.
+    Пути со значением None пропускаются.
+    cache: StageCache — результаты стадий берутся с диска, если не менялись
+           seed, размеры и параметры стадии и всех стадий выше (нужен seed)
+    buffers: готовые массивы слоёв WorldGenerator (например, в shared memory)
+    on_stage: вызывается с именем стадии после её завершения
+    compact: float32/int16 слои (WorldGenerator(compact=True))
+    memory_budget: байты; compact включается сам, если обычный режим не влезает
+    """
+    compact = resolve_compact(width, height, compact, memory_budget)
+    if seed is None:
+        cache = None
+
+    with profiling.stage("tectonics"):
+        tectonics_gen = TectonicsGenerator(width=width, height=height, plates_count=plates_count, seed=seed)
+        result = {}
+
+        def grow():
+            result["plate_map"], result["plates"] = tectonics_gen.generate()
+            return dict(result)
+
+        params = dict(width=width, height=height, plates_count=plates_count, seed=seed,
+                      noise_scale=tectonics_gen.NOISE_SCALE, noise_strength=tectonics_gen.NOISE_STRENGTH)
+        upstream = _cached_stage(cache, "plates", params, None, grow, result.update)
+        plate_map, plates = result["plate_map"], result["plates"]
+        tectonics_gen.plate_map, tectonics_gen.plates = plate_map, plates
+    if on_stage:
+        on_stage("tectonics")
+    if visualize:
+        tectonics_gen.visualize()
+    # cost_map и прочие массивы роста плит дальше не нужны (grow держит имена в замыкании)
+    tectonics_gen = result = None
+
+    world_gen = WorldGenerator(width=width, height=height, plate_map=plate_map, plates=plates, seed=seed,
+                               buffers=buffers, compact=compact)
+    stage_params = {"detect_boundaries": {}, "apply_terrain": {"compact": compact},
+                    "assign_biomes": {"table": biome_table, "compact": compact}}
+    for name in WORLD_STAGES:
+        with profiling.stage(name):
+            if name in CACHED_LAYERS:
+                def compute(name=name):
+                    if name == "assign_biomes":
+                        world_gen.assign_biomes(biome_table)
+                    else:
+                        getattr(world_gen, name)()
+                    return {layer: getattr(world_gen, layer) for layer in CACHED_LAYERS[name]}
+
+                def restore(payload):
+                    for layer, data in payload.items():
+                        getattr(world_gen, layer)[:] = data
+
+                upstream = _cached_stage(cache, name, stage_params[name], upstream, compute, restore)
+            else:
+                getattr(world_gen, name)()
+        if on_stage:
+            on_stage(name)
+
+    if h5_path:
+        with profiling.stage("export_hdf5"):
+            world_gen.export_hdf5(h5_path, steps=steps)
+    if png_path:
+        with profiling.stage("export_png"):
+            world_gen.export_png(png_path, steps=steps)
+    if heightmap_path:
+        with profiling.stage("export_heightmap_png"):
+            world_gen.export_heightmap_png(heightmap_path)
+    return world_gen
+
+
+def run_traced(trace_path=None, profile_dir=None, **kwargs):
+    """
+    generate_world под Tracer: Chrome-trace в trace_path, cProfile стадий
+    в profile_dir (*.prof), сводная таблица в stdout.
+    """
+    with Tracer(profile=profile_dir is not None) as tracer:
+        world_gen = generate_world(**kwargs)
+    if trace_path:
+        tracer.write_chrome_trace(trace_path)
+    if profile_dir:
+        tracer.dump_profiles(profile_dir)
+    print(tracer.summary())
+    return world_gen
+
+
+def run(cache_dir=None, trace_path=None, profile_dir=None, **kwargs):
+    """
+    generate_world с кэшем стадий в cache_dir (StageCache) и под run_traced,
+    если задан trace_path или profile_dir; остальное — в generate_world.
+    """
+    if cache_dir:
+        from stagecache import StageCache
+        kwargs["cache"] = StageCache(cache_dir)
+    if trace_path or profile_dir:
+        return run_traced(trace_path=trace_path, profile_dir=profile_dir, **kwargs)
+    return generate_world(**kwargs)
@@ -0,0 +1,190 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# -----------------------------
+# Трассировка конвейера генерации
+# -----------------------------
+# Код стадий вызывает profiling.stage(...) и profiling.count(...); без
+# активного Tracer это пустые операции, так что в обычном запуске
+# инструментирование почти ничего не стоит.
+
+_active = None
+
+
+# -----------------------------
+# Пик RSS процесса (Linux: VmHWM из /proc/self/status, сброс через clear_refs)
+# -----------------------------
+def rss_peak():
+    """Пик RSS в байтах с последнего сброса или None, если /proc недоступен."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def reset_rss_peak():
+    # Сброс пика до текущего RSS; False, если ядро не позволяет
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+class Tracer:
+    """
+    Таймеры стадий, пик памяти tracemalloc (прирост относительно начала стадии),
+    пик RSS процесса внутри стадии (rss=True, только Linux), счётчики и,
+    по желанию, cProfile каждой стадии верхнего уровня.
+
+        with Tracer(profile=True) as tracer:
+            ...
+        tracer.write_chrome_trace("trace.json")
+        print(tracer.summary())
+    """
+    def __init__(self, memory=True, profile=False, rss=True):
+        self.memory = memory
+        self.profile = profile
+        self.rss = rss and reset_rss_peak()
+        self.events = []
+        self.counters = {}
+        self.profiles = {}
+        self._stack = []
+        self._lock = threading.Lock()
+        self._t0 = time.perf_counter_ns()
+        self._prev = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+        global _active
+        self._prev, _active = _active, self
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self._prev
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    @contextmanager
+    def stage(self, name):
+        event = {"name": name, "depth": len(self._stack), "counters": {}}
+        tracing = self.memory and tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_peak"] = max(parent["_peak"], peak)
+            tracemalloc.reset_peak()
+            event["_start_mem"] = current
+            event["_peak"] = current
+        if self.rss:
+            # Пик родителя до сброса переносится в него, как и для tracemalloc
+            if self._stack:
+                parent = self._stack[-1]
+                parent["_rss_peak"] = max(parent["_rss_peak"], rss_peak())
+            reset_rss_peak()
+            event["_rss_peak"] = rss_peak()
+
+        profiler = None
+        if self.profile and not self._stack:
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        self._stack.append(event)
+        event["start_ns"] = time.perf_counter_ns()
+        try:
+            yield event
+        finally:
+            event["dur_ns"] = time.perf_counter_ns() - event["start_ns"]
+            if profiler is not None:
+                profiler.disable()
+                self.profiles[name] = profiler
+            self._stack.pop()
+            if tracing:
+                _, peak = tracemalloc.get_traced_memory()
+                event["_peak"] = max(event["_peak"], peak)
+                event["peak_delta_bytes"] = event["_peak"] - event["_start_mem"]
+                if self._stack:
+                    self._stack[-1]["_peak"] = max(self._stack[-1]["_peak"], event["_peak"])
+            if self.rss:
+                event["rss_peak_bytes"] = max(event["_rss_peak"], rss_peak())
+                if self._stack:
+                    self._stack[-1]["_rss_peak"] = max(self._stack[-1]["_rss_peak"], event["rss_peak_bytes"])
+            with self._lock:
+                self.events.append(event)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if self._stack:
+                stage_counters = self._stack[-1]["counters"]
+                stage_counters[name] = stage_counters.get(name, 0) + n
+
+    # -----------------------------
+    def chrome_trace(self):
+        """События в формате Chrome Trace Event (chrome://tracing, Perfetto)."""
+        pid = os.getpid()
+        trace = []
+        for event in sorted(self.events, key=lambda e: e["start_ns"]):
+            args = dict(event["counters"])
+            for key in ("peak_delta_bytes", "rss_peak_bytes"):
+                if key in event:
+                    args[key] = event[key]
+            ts = (event["start_ns"] - self._t0) / 1000
+            trace.append({"name": event["name"], "ph": "X", "pid": pid, "tid": 0,
+                          "ts": ts, "dur": event["dur_ns"] / 1000, "args": args})
+            if event["counters"]:
+                trace.append({"name": "counters", "ph": "C", "pid": pid, "tid": 0,
+                              "ts": ts + event["dur_ns"] / 1000, "args": event["counters"]})
+        return {"traceEvents": trace, "displayTimeUnit": "ms", "otherData": {"counters": self.counters}}
+
+    def write_chrome_trace(self, filename):
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"[INFO] Trace written to {filename}")
+
+    def dump_profiles(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name, profiler in self.profiles.items():
+            profiler.dump_stats(os.path.join(directory, f"{name}.prof"))
+        print(f"[INFO] Stage profiles written to {directory}")
+
+    def summary(self):
+        lines = [f"{'stage':<24}{'time, ms':>12}{'peak, MiB':>12}{'RSS, MiB':>12}  counters"]
+        for event in sorted(self.events, key=lambda e: e["start_ns"]):
+            name = "  " * event["depth"] + event["name"]
+            mem_text = ""
+            for key in ("peak_delta_bytes", "rss_peak_bytes"):
+                value = event.get(key)
+                mem_text += f"{value / 2**20:12.1f}" if value is not None else f"{'-':>12}"
+            counters = ", ".join(f"{k}={v}" for k, v in sorted(event["counters"].items()))
+            lines.append(f"{name:<24}{event['dur_ns'] / 1e6:12.1f}{mem_text}  {counters}")
+        return "\n".join(lines)
+
+
+def active():
+    return _active
+
+
+def stage(name):
+    return _active.stage(name) if _active is not None else nullcontext()
+
+
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
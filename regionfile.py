@@ -0,0 +1,250 @@
+import mmap
+import os
+import threading
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+# -----------------------------
+# Регион-файлы чанков
+# -----------------------------
+# Регион (rx, ry) хранит до REGION×REGION чанков в одном файле r.<rx>.<ry>.region:
+#   заголовок   HEADER_DTYPE: magic, версия, REGION, размер чанка
+#   таблица     REGION*REGION записей TABLE_DTYPE (offset, length, raw_length, revision, flags),
+#               индекс записи (cy % REGION) * REGION + (cx % REGION); length 0 — чанка нет;
+#               revision — ревизия файла мира, по которому чанк построен, flags — FLAG_*
+#   данные      zlib(ground | objects | height) каждого чанка
+# Запись только дописывает данные в конец и обновляет таблицу, поэтому
+# перезаписанные чанки оставляют мусор; compact() переписывает файл начисто.
+# Чтение идёт через mmap без копирования файла.
+REGION = 32
+MAGIC = b"CRGN"
+VERSION = 2
+ZLIB_LEVEL = 3
+
+HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u2"), ("region", "<u2"), ("chunk_size", "<u2"),
+                         ("reserved", "<u2", 3)])
+TABLE_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4"), ("raw_length", "<u4"),
+                        ("revision", "<u4"), ("flags", "<u4")])
+TABLE_OFFSET = HEADER_DTYPE.itemsize
+DATA_OFFSET = TABLE_OFFSET + REGION * REGION * TABLE_DTYPE.itemsize
+
+FLAG_EDITED = 1  # чанк правил игрок (иначе — сохранённый результат генерации)
+
+# Слои чанка в порядке записи
+LAYERS = [("ground", np.uint8), ("objects", np.uint8), ("height", np.float32)]
+
+
+def region_of(key):
+    """(rx, ry), номер записи в таблице."""
+    cx, cy = key
+    return (cx // REGION, cy // REGION), (cy % REGION) * REGION + (cx % REGION)
+
+
+def encode_chunk(chunk):
+    raw = b"".join(np.ascontiguousarray(chunk[name], dtype=dtype).tobytes() for name, dtype in LAYERS)
+    return zlib.compress(raw, ZLIB_LEVEL), len(raw)
+
+
+def decode_chunk(payload, chunk_size):
+    raw = zlib.decompress(payload)
+    chunk = {}
+    pos = 0
+    for name, dtype in LAYERS:
+        n = chunk_size * chunk_size * np.dtype(dtype).itemsize
+        # copy: чанки правятся на месте, а буфер raw неизменяемый
+        chunk[name] = np.frombuffer(raw, dtype=dtype, count=chunk_size * chunk_size, offset=pos) \
+            .reshape(chunk_size, chunk_size).copy()
+        pos += n
+    return chunk
+
+
+class RegionFile:
+    def __init__(self, path):
+        self.path = path
+        if os.path.exists(path):
+            self.file = open(path, "r+b")
+            header = np.frombuffer(self.file.read(HEADER_DTYPE.itemsize), dtype=HEADER_DTYPE)[0]
+            if header["magic"] != MAGIC or header["version"] != VERSION or header["region"] != REGION:
+                raise ValueError(f"Not a region file (v{VERSION}, {REGION}x{REGION}): {path}")
+            self.chunk_size = int(header["chunk_size"])
+            self.table = np.frombuffer(self.file.read(DATA_OFFSET - TABLE_OFFSET), dtype=TABLE_DTYPE).copy()
+        else:
+            self.file = open(path, "w+b")
+            self.chunk_size = 0
+            self.table = np.zeros(REGION * REGION, dtype=TABLE_DTYPE)
+            self._write_header()
+        self._mmap = None
+
+    def _write_header(self):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"], header["version"], header["region"] = MAGIC, VERSION, REGION
+        header["chunk_size"] = self.chunk_size
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.write(self.table.tobytes())
+
+    def _view(self):
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def read_many(self, slots):
+        """Чанки по номерам записей; None для отсутствующих."""
+        chunks = []
+        view = None
+        for slot in slots:
+            entry = self.table[slot]
+            if entry["length"] == 0:
+                chunks.append(None)
+                continue
+            if view is None:
+                view = self._view()
+            start = int(entry["offset"])
+            chunks.append(decode_chunk(view[start:start + int(entry["length"])], self.chunk_size))
+        return chunks
+
+    def stamps(self, slots):
+        """(revision, flags) по номерам записей; None для отсутствующих."""
+        return [None if self.table[slot]["length"] == 0
+                else (int(self.table[slot]["revision"]), int(self.table[slot]["flags"])) for slot in slots]
+
+    def write_many(self, items):
+        """items: [(номер записи, чанк, (revision, flags))] — все данные одной дозаписью, затем таблица."""
+        if not items:
+            return
+        if self.chunk_size == 0:
+            self.chunk_size = items[0][1]["ground"].shape[0]
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.file.seek(0, os.SEEK_END)
+        offset = max(self.file.tell(), DATA_OFFSET)
+        payloads = []
+        for slot, chunk, (revision, flags) in items:
+            payload, raw_length = encode_chunk(chunk)
+            self.table[slot] = (offset, len(payload), raw_length, revision, flags)
+            offset += len(payload)
+            payloads.append(payload)
+        self.file.seek(0, os.SEEK_END)
+        self.file.write(b"".join(payloads))
+        self._write_header()
+        self.file.flush()
+
+    def garbage_bytes(self):
+        self.file.seek(0, os.SEEK_END)
+        return self.file.tell() - DATA_OFFSET - int(self.table["length"].sum())
+
+    def compact(self):
+        # Переписать только живые данные во временный файл и подменить
+        view = self._view() if self.table["length"].any() else None
+        table = np.zeros_like(self.table)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as out:
+            out.seek(DATA_OFFSET)
+            for slot in np.nonzero(self.table["length"])[0]:
+                entry = self.table[slot]
+                start = int(entry["offset"])
+                table[slot] = entry
+                table[slot]["offset"] = out.tell()
+                out.write(view[start:start + int(entry["length"])])
+        self.close()
+        os.replace(tmp_path, self.path)
+        self.file = open(self.path, "r+b")
+        self.table = table
+        self._write_header()
+        self.file.flush()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self.file.close()
+
+
+class RegionStore:
+    """
+    Каталог регион-файлов. load_many/save_many группируют ключи по регионам:
+    одна дозапись и одно обновление таблицы на регион за вызов.
+    """
+    def __init__(self, directory="chunks", max_open=16):
+        self.directory = directory
+        self.max_open = max_open
+        self._regions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, region):
+        return os.path.join(self.directory, f"r.{region[0]}.{region[1]}.region")
+
+    def _region(self, region, create=False):
+        handle = self._regions.get(region)
+        if handle is not None:
+            self._regions.move_to_end(region)
+            return handle
+        path = self._path(region)
+        if not create and not os.path.exists(path):
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        handle = self._regions[region] = RegionFile(path)
+        while len(self._regions) > self.max_open:
+            self._regions.popitem(last=False)[1].close()
+        return handle
+
+    @staticmethod
+    def _group(keys):
+        groups = {}
+        for key in keys:
+            region, slot = region_of(key)
+            groups.setdefault(region, []).append((key, slot))
+        return groups
+
+    def load_many(self, keys):
+        """dict key -> чанк для найденных на диске ключей."""
+        found = {}
+        with self._lock:
+            for region, entries in self._group(keys).items():
+                handle = self._region(region)
+                if handle is None:
+                    continue
+                chunks = handle.read_many([slot for _, slot in entries])
+                for (key, _), chunk in zip(entries, chunks):
+                    if chunk is not None:
+                        found[key] = chunk
+        return found
+
+    def stamps(self, keys):
+        """dict key -> (revision, flags) для найденных на диске ключей; данные не читаются."""
+        found = {}
+        with self._lock:
+            for region, entries in self._group(keys).items():
+                handle = self._region(region)
+                if handle is None:
+                    continue
+                for (key, _), stamp in zip(entries, handle.stamps([slot for _, slot in entries])):
+                    if stamp is not None:
+                        found[key] = stamp
+        return found
+
+    def save_many(self, chunks, stamps=None):
+        """chunks: dict key -> чанк; stamps: dict key -> (revision, flags), по умолчанию (0, 0)."""
+        stamps = stamps or {}
+        with self._lock:
+            for region, entries in self._group(chunks).items():
+                self._region(region, create=True).write_many(
+                    [(slot, chunks[key], stamps.get(key, (0, 0))) for key, slot in entries])
+
+    def compact(self):
+        # Все регион-файлы каталога
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            for name in sorted(os.listdir(self.directory)):
+                parts = name.split(".")
+                if len(parts) == 4 and parts[0] == "r" and parts[3] == "region":
+                    self._region((int(parts[1]), int(parts[2]))).compact()
+
+    def close(self):
+        with self._lock:
+            for handle in self._regions.values():
+                handle.close()
+            self._regions.clear()
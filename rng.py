@@ -0,0 +1,46 @@
+import zlib
+import numpy as np
+
+# -----------------------------
+# Случайные поля, адресуемые по координатам мира
+# -----------------------------
+# Мир режется на блоки BLOCK×BLOCK; у каждого блока свой поток Philox,
+# ключ которого — (seed, стадия, by, bx). Значение клетки зависит только
+# от этих величин, поэтому любая область (тайл, окно с полями) даёт
+# те же числа, что и генерация всего мира целиком. Сущности, которые не
+# привязаны к клетке (плиты), получают поток по своему номеру — item_generator.
+BLOCK = 256
+
+
+def stage_key(stage):
+    return zlib.crc32(stage.encode("utf-8"))
+
+
+def block_generator(seed, stage, by, bx):
+    seq = np.random.SeedSequence([seed, stage_key(stage), by, bx])
+    return np.random.Generator(np.random.Philox(seq))
+
+
+def item_generator(seed, stage, index):
+    # Свой поток для отдельной сущности стадии (плита, её seed-клетка): ключ (seed, стадия, index)
+    seq = np.random.SeedSequence([seed, stage_key(stage), index])
+    return np.random.Generator(np.random.Philox(seq))
+
+
+def block_uniform(seed, stage, y0, y1, x0, x1, block=BLOCK, out=None):
+    """
+    Равномерные числа [0, 1) для области мира [y0:y1, x0:x1], float64.
+    out: готовый массив (y1-y0, x1-x0) любого float dtype — значения приводятся к нему
+    """
+    if out is None:
+        out = np.empty((y1 - y0, x1 - x0))
+    if out.size == 0:
+        return out
+    for by in range(y0 // block, (y1 - 1) // block + 1):
+        for bx in range(x0 // block, (x1 - 1) // block + 1):
+            values = block_generator(seed, stage, by, bx).random((block, block))
+            ys, ye = max(y0, by * block), min(y1, (by + 1) * block)
+            xs, xe = max(x0, bx * block), min(x1, (bx + 1) * block)
+            out[ys - y0:ye - y0, xs - x0:xe - x0] = values[ys - by * block:ye - by * block,
+                                                          xs - bx * block:xe - bx * block]
+    return out
@@ -0,0 +1,591 @@
+import numpy as np
+from scipy.ndimage import label, find_objects
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from world import BIOME_NAMES, BIOME_CODE, WATER_BIOMES
+from worldfile import create_layer, write_region
+
+# -----------------------------
+# Пространственные индексы мира
+# -----------------------------
+# Считаются при экспорте и лежат в группе index файла world_data.h5:
+#   continents, oceans   (H, W) метки связных областей суши/воды (4-связность),
+#                        0 — клетка другого класса
+#   continent_sizes/bbox, ocean_sizes/bbox   размеры и (y0, y1, x0, x1) меток 1..N
+#                        (строка 0 — пустышка; после patch_hdf5 бывают пустые
+#                        строки размера 0 — см. update_indexes)
+#   coastline            (N, 2) [y, x] клеток суши, соседних с водой, построчно
+#   biome_count/bbox     по коду биома
+#   border, border_offsets  [y, x] граничных клеток каждого биома (CSR по коду).
+#                        Ближайшая клетка биома к точке вне его всегда граничная,
+#                        поэтому KD-дерева строятся только по ним.
+#
+# Индексы собираются полосами строк (тайловый режим читает biome прямо из
+# HDF5): метки полос склеиваются по швам, итоговые номера — в порядке первой
+# клетки при построчном обходе, как у scipy.ndimage.label по всей карте.
+FOUR_CONNECTED = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]])
+INDEX_BAND_CELLS = 1 << 20  # клеток в полосе (~40 МиБ временных массивов)
+
+
+def _bboxes(slices, count, y_offset=0):
+    bbox = np.full((count + 1, 4), -1, dtype=np.int32)
+    for i, s in enumerate(slices, start=1):
+        if s is not None:
+            bbox[i] = (s[0].start + y_offset, s[0].stop + y_offset, s[1].start, s[1].stop)
+    return bbox
+
+
+def _differs_from_neighbour(a):
+    # Клетки, у которых хотя бы один 4-сосед в пределах карты имеет другое значение
+    out = np.zeros(a.shape, dtype=bool)
+    diff = a[1:, :] != a[:-1, :]
+    out[1:, :] |= diff
+    out[:-1, :] |= diff
+    diff = a[:, 1:] != a[:, :-1]
+    out[:, 1:] |= diff
+    out[:, :-1] |= diff
+    return out
+
+
+class _Components:
+    """
+    Связные области маски, собираемые полосами сверху вниз. add() даёт
+    полосе временные номера (сквозные), resolve() склеивает их по швам,
+    relabel() переводит полосу в итоговые метки.
+    """
+    def __init__(self):
+        self.total = 0
+        self.starts = []     # первый временный номер и число областей каждой полосы
+        self.sizes = [np.zeros(1, dtype=np.int64)]
+        self.bboxes = [np.full((1, 4), -1, dtype=np.int32)]
+        self.seams = []      # пары временных номеров, соседних через шов
+        self._last_row = None
+
+    def _shift(self, row):
+        row = row.astype(np.int64)
+        row[row > 0] += self.total
+        return row
+
+    def add(self, mask, y0):
+        labels, count = label(mask, structure=FOUR_CONNECTED)
+        self.starts.append((self.total, count))
+        self.sizes.append(np.bincount(labels.ravel(), minlength=count + 1)[1:].astype(np.int64))
+        self.bboxes.append(_bboxes(find_objects(labels), count, y0)[1:])
+        first = self._shift(labels[0])
+        if self._last_row is not None:
+            both = (self._last_row > 0) & (first > 0)
+            self.seams.append(np.stack([self._last_row[both], first[both]], axis=1))
+        self._last_row = self._shift(labels[-1])
+        self.total += count
+
+    def resolve(self):
+        # Временный номер -> итоговая метка; компоненты нумеруются по наименьшему
+        # временному номеру, т.е. по первой клетке в построчном обходе
+        n = self.total + 1
+        pairs = np.concatenate(self.seams) if self.seams else np.zeros((0, 2), dtype=np.int64)
+        graph = csr_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])), shape=(n, n))
+        _, component = connected_components(graph, directed=False)
+        first = np.full(component.max() + 1, n, dtype=np.int64)
+        np.minimum.at(first, component, np.arange(n))
+        rank = np.empty_like(first)
+        rank[np.argsort(first, kind="stable")] = np.arange(len(first))
+        self.final = rank[component]  # временный 0 (фон) получает 0
+        self.count = len(first) - 1
+
+        sizes = np.concatenate(self.sizes)
+        bbox = np.concatenate(self.bboxes)
+        self.final_sizes = np.bincount(self.final, weights=sizes, minlength=self.count + 1).astype(np.int64)
+        self.final_sizes[0] = 0
+        final_bbox = np.full((self.count + 1, 4), -1, dtype=np.int32)
+        big = np.iinfo(np.int32).max
+        lo = np.full((self.count + 1, 2), big, dtype=np.int32)
+        hi = np.full((self.count + 1, 2), -1, dtype=np.int32)
+        present = self.final > 0
+        np.minimum.at(lo, self.final[present], bbox[present][:, [0, 2]])
+        np.maximum.at(hi, self.final[present], bbox[present][:, [1, 3]])
+        final_bbox[1:, 0], final_bbox[1:, 2] = lo[1:, 0], lo[1:, 1]
+        final_bbox[1:, 1], final_bbox[1:, 3] = hi[1:, 0], hi[1:, 1]
+        self.final_bbox = final_bbox
+        self.dtype = np.uint16 if self.count < np.iinfo(np.uint16).max else np.int32
+
+    def relabel(self, mask, band_index):
+        # Та же разметка полосы, что и в add (label детерминирован)
+        labels, _ = label(mask, structure=FOUR_CONNECTED)
+        start, count = self.starts[band_index]
+        lut = np.zeros(count + 1, dtype=self.dtype)
+        lut[1:] = self.final[start + 1:start + count + 1]
+        return lut[labels]
+
+
+def _index_bands(biome, band):
+    height, width = biome.shape
+    rows = band or max(1, INDEX_BAND_CELLS // max(1, width))
+    for y0 in range(0, height, rows):
+        y1 = min(height, y0 + rows)
+        # Строка соседей сверху и снизу — для клеток на краю полосы
+        h0, h1 = max(0, y0 - 1), min(height, y1 + 1)
+        yield y0, y1, np.asarray(biome[h0:h1]), y0 - h0
+
+
+def _band_cells(block, top, y0, y1):
+    # Вода, прибрежные клетки и граничные клетки (по коду, внутри кода построчно) полосы
+    n = len(BIOME_NAMES)
+    core = slice(top, top + y1 - y0)
+    water_block = np.isin(block, WATER_BIOMES)
+    water = water_block[core]
+    coast = ~water & _differs_from_neighbour(water_block)[core]
+    coastline = np.argwhere(coast).astype(np.int32)
+    coastline[:, 0] += y0
+    ys, xs = np.nonzero(_differs_from_neighbour(block)[core])
+    codes = block[core][ys, xs]
+    order = np.argsort(codes, kind="stable")
+    border = np.stack([ys[order] + y0, xs[order]], axis=1).astype(np.int32)
+    return water, coastline, border, np.bincount(codes, minlength=n)
+
+
+def index_layers(biome, create, band=None):
+    """
+    Считает индексы в два прохода полосами по band строк и отдаёт их через
+    create(имя, shape, dtype, data=None) -> набор (массив или HDF5-набор).
+    Первый проход — метки полос, размеры, счётчики; второй пишет метки,
+    берег и границы в созданные наборы, так что память — порядка полосы.
+    biome: (H, W) коды биомов — массив или набор HDF5.
+    """
+    n = len(BIOME_NAMES)
+    height, width = biome.shape
+    continents, oceans = _Components(), _Components()
+    coast_total = 0
+    border_counts = np.zeros(n, dtype=np.int64)
+    biome_count = np.zeros(n, dtype=np.int64)
+    biome_bbox = np.full((n, 4), -1, dtype=np.int32)
+
+    for y0, y1, block, top in _index_bands(biome, band):
+        water, coastline, _, counts = _band_cells(block, top, y0, y1)
+        continents.add(~water, y0)
+        oceans.add(water, y0)
+        coast_total += len(coastline)
+        border_counts += counts
+
+        codes_band = block[top:top + y1 - y0]
+        biome_count += np.bincount(codes_band.ravel(), minlength=n)
+        # find_objects по кодам: метка k -> код k
+        band_bbox = _bboxes(find_objects(codes_band.astype(np.int32), max_label=n - 1), n - 1, y0)
+        new = (biome_bbox[:, 0] < 0) & (band_bbox[:, 0] >= 0)
+        biome_bbox[new] = band_bbox[new]
+        seen = band_bbox[:, 0] >= 0
+        biome_bbox[seen, 1] = band_bbox[seen, 1]
+        biome_bbox[seen, 2] = np.minimum(biome_bbox[seen, 2], band_bbox[seen, 2])
+        biome_bbox[seen, 3] = np.maximum(biome_bbox[seen, 3], band_bbox[seen, 3])
+
+    for name, components in (("continent", continents), ("ocean", oceans)):
+        components.resolve()
+        create(f"{name}_sizes", components.final_sizes.shape, np.int64, data=components.final_sizes)
+        create(f"{name}_bbox", components.final_bbox.shape, np.int32, data=components.final_bbox)
+    border_offsets = np.zeros(n + 1, dtype=np.int64)
+    border_offsets[1:] = np.cumsum(border_counts)
+    create("border_offsets", border_offsets.shape, np.int64, data=border_offsets)
+    create("biome_count", biome_count.shape, np.int64, data=biome_count)
+    create("biome_bbox", biome_bbox.shape, np.int32, data=biome_bbox)
+
+    layers = {name: create(name, (height, width), components.dtype)
+              for name, components in (("continents", continents), ("oceans", oceans))}
+    coast_out = create("coastline", (coast_total, 2), np.int32)
+    border_out = create("border", (int(border_offsets[-1]), 2), np.int32)
+    coast_pos = 0
+    border_pos = border_offsets[:-1].copy()
+    for i, (y0, y1, block, top) in enumerate(_index_bands(biome, band)):
+        water, coastline, border, counts = _band_cells(block, top, y0, y1)
+        write_region(layers["continents"], y0, 0, continents.relabel(~water, i))
+        write_region(layers["oceans"], y0, 0, oceans.relabel(water, i))
+        if len(coastline):
+            write_region(coast_out, coast_pos, 0, coastline)
+            coast_pos += len(coastline)
+        # Граничные клетки полосы дописываются в конец части своего кода
+        start = 0
+        for code in np.nonzero(counts)[0]:
+            write_region(border_out, int(border_pos[code]), 0, border[start:start + counts[code]])
+            border_pos[code] += counts[code]
+            start += counts[code]
+
+
+def build_indexes(biome, band=None):
+    """biome: (H, W) коды биомов. Возвращает {имя набора: массив}."""
+    out = {}
+
+    def create(name, shape, dtype, data=None):
+        out[name] = np.asarray(data, dtype=dtype) if data is not None else np.empty(shape, dtype=dtype)
+        return out[name]
+
+    index_layers(biome, create, band=band)
+    return out
+
+
+def write_indexes(f, biome, compression="gzip", band=None):
+    """
+    Перезаписывает группу index целиком. biome может быть набором HDF5:
+    он читается полосами, и память не зависит от размера карты.
+    """
+    if "index" in f:
+        del f["index"]
+    group = f.create_group("index")
+
+    def create(name, shape, dtype, data=None):
+        if name in ("continents", "oceans"):
+            return create_layer(group, name, shape, dtype, data=data, compression=compression)
+        return group.create_dataset(name, shape=shape, dtype=dtype, data=data)
+
+    index_layers(biome, create, band=band)
+    return group
+
+
+# -----------------------------
+# Правка индексов на месте (WorldGenerator.patch_hdf5)
+# -----------------------------
+# Пересчитывается только rect с кольцом соседей. Метки материков и океанов
+# нелокальны, но меняются лишь области, касающиеся rect: области внутри rect
+# склеиваются по кольцу со старыми метками. При слиянии остаётся метка самой
+# большой области, клетки остальных переписываются в их рамках; распад старой
+# области проверяется в окне, растущем от rect до её рамки. Освободившиеся
+# метки остаются пустыми строками (размер 0), новые дописываются в конец —
+# после правок метки не идут по первой клетке и могут иметь пропуски.
+
+def _expand(rect, margin, shape):
+    y0, y1, x0, x1 = rect
+    return max(0, y0 - margin), min(shape[0], y1 + margin), max(0, x0 - margin), min(shape[1], x1 + margin)
+
+
+def _box_union(a, b):
+    if a[0] < 0:
+        return tuple(b)
+    if b[0] < 0:
+        return tuple(a)
+    return min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+
+
+def _shrink_box(grid, value, box):
+    # Сужает рамку-надмножество (y0, y1, x0, x1) до клеток grid == value;
+    # grid — массив или набор HDF5, читается построчно/постолбцово от краёв
+    y0, y1, x0, x1 = (int(v) for v in box)
+    if y0 < 0:
+        return -1, -1, -1, -1
+    while y0 < y1 and not (grid[y0, x0:x1] == value).any():
+        y0 += 1
+    if y0 == y1:
+        return -1, -1, -1, -1
+    while not (grid[y1 - 1, x0:x1] == value).any():
+        y1 -= 1
+    while not (grid[y0:y1, x0] == value).any():
+        x0 += 1
+    while not (grid[y0:y1, x1 - 1] == value).any():
+        x1 -= 1
+    return y0, y1, x0, x1
+
+
+def _replace_points(points, keys, window, new_points, new_keys, shape):
+    # Точки [y, x] вне window плюс новые точки window в порядке (key, y, x)
+    y0, y1, x0, x1 = window
+    inside = (points[:, 0] >= y0) & (points[:, 0] < y1) & (points[:, 1] >= x0) & (points[:, 1] < x1)
+    points = np.concatenate([points[~inside], new_points]).astype(np.int32)
+    keys = np.concatenate([keys[~inside], new_keys]).astype(np.int64)
+    order = np.argsort((keys * shape[0] + points[:, 0]) * shape[1] + points[:, 1])
+    return points[order], keys[order]
+
+
+def _outside_pieces(layer, value, box, rect, ring):
+    """
+    Куски старой области value без клеток rect: None, если её клетки на кольце
+    (ring: ys, xs) связаны и так, иначе (метки кусков, их число, окно).
+    box — рамка области; окно растёт от rect до неё.
+    """
+    box = tuple(int(v) for v in box)
+    ry0, ry1, rx0, rx1 = rect
+    margin = 16
+    while True:
+        wy0, wy1, wx0, wx1 = _expand(rect, margin, (box[1], box[3]))
+        window = max(wy0, box[0]), wy1, max(wx0, box[2]), wx1
+        wy0, wy1, wx0, wx1 = window
+        cells = layer[wy0:wy1, wx0:wx1] == value
+        cells[max(0, ry0 - wy0):max(0, ry1 - wy0), max(0, rx0 - wx0):max(0, rx1 - wx0)] = False
+        pieces, count = label(cells, structure=FOUR_CONNECTED)
+        if len(np.unique(pieces[ring[0] - wy0, ring[1] - wx0])) == 1:
+            return None
+        if window == box:
+            return pieces, count, window
+        margin *= 4
+
+
+def _update_components(group, prefix, layer_name, biome, rect, water):
+    """
+    Метки областей воды (water=True) или суши после правки rect.
+    False, если новые метки не влезают в тип набора — нужна полная пересборка.
+    """
+    layer = group[layer_name]
+    y0, y1, x0, x1 = rect
+    ey0, ey1, ex0, ex1 = _expand(rect, 1, biome.shape)
+    old = layer[ey0:ey1, ex0:ex1].astype(np.int64)
+    mask = np.isin(np.asarray(biome[ey0:ey1, ex0:ex1]), WATER_BIOMES) == water
+    inner = np.zeros(old.shape, dtype=bool)
+    inner[y0 - ey0:y1 - ey0, x0 - ex0:x1 - ex0] = True
+    if np.array_equal(old[inner] > 0, mask[inner]):
+        return True
+
+    sizes = group[f"{prefix}_sizes"][()]
+    bbox = group[f"{prefix}_bbox"][()]
+    in_rect = np.bincount(old[inner], minlength=len(sizes))
+    lost = set(np.unique(old[inner & ~mask]).tolist())
+    local, m = label(mask & inner, structure=FOUR_CONNECTED)
+    local_sizes = np.bincount(local.ravel(), minlength=m + 1)
+    local_boxes = _bboxes(find_objects(local), m, ey0)
+    local_boxes[1:, 2:] += ex0
+
+    # Узлы: старые области на кольце (или куски распавшихся); ring_node — узел клетки кольца
+    nodes = []  # (старая метка, клеток вне rect, рамка, (куски, номер, окно) или None)
+    ring = np.where(inner, 0, old)
+    ring_node = np.full(old.shape, -1, dtype=np.int64)
+    for value in np.unique(ring[ring > 0]).tolist():
+        ys, xs = np.nonzero(ring == value)
+        split = None
+        if value in lost:
+            split = _outside_pieces(layer, value, bbox[value], rect, (ys + ey0, xs + ex0))
+        if split is None:
+            ring_node[ys, xs] = len(nodes)
+            nodes.append((value, int(sizes[value] - in_rect[value]), tuple(bbox[value]), None))
+            continue
+        pieces, count, window = split
+        piece_sizes = np.bincount(pieces.ravel(), minlength=count + 1)
+        piece_boxes = _bboxes(find_objects(pieces), count, window[0])
+        piece_boxes[1:, 2:] += window[2]
+        ring_node[ys, xs] = len(nodes) - 1 + pieces[ys + ey0 - window[0], xs + ex0 - window[2]]
+        for piece in range(1, count + 1):
+            nodes.append((value, int(piece_sizes[piece]), tuple(piece_boxes[piece]), (pieces, piece, window)))
+
+    # Области rect и узлы, соседние через кольцо, — одна новая область
+    edges = []
+    for dy, dx in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        a = local[max(0, -dy):local.shape[0] - max(0, dy), max(0, -dx):local.shape[1] - max(0, dx)]
+        b = ring_node[max(0, dy):old.shape[0] - max(0, -dy), max(0, dx):old.shape[1] - max(0, -dx)]
+        both = (a > 0) & (b >= 0)
+        edges.append(np.stack([a[both] - 1, b[both] + m], axis=1))
+    edges = np.concatenate(edges)
+    n = m + len(nodes)
+    graph = csr_matrix((np.ones(len(edges), dtype=np.int8), (edges[:, 0], edges[:, 1])), shape=(n, n))
+    groups, component = connected_components(graph, directed=False) if n else (0, np.zeros(0, dtype=np.int32))
+
+    # Метка группы — старая метка самого большого её узла, если ещё не занята
+    group_label = np.zeros(groups, dtype=np.int64)
+    claimed = set()
+    for i in sorted(range(len(nodes)), key=lambda i: -nodes[i][1]):
+        g = component[m + i]
+        if group_label[g] == 0 and nodes[i][0] not in claimed:
+            group_label[g] = nodes[i][0]
+            claimed.add(nodes[i][0])
+    freed = sorted((set(np.nonzero(in_rect)[0].tolist()) | {node[0] for node in nodes}) - {0} - claimed)
+    total = len(sizes) - 1
+    for g in np.nonzero(group_label == 0)[0]:
+        if freed:
+            group_label[g] = freed.pop(0)
+        else:
+            total += 1
+            group_label[g] = total
+    if total >= np.iinfo(layer.dtype).max:
+        return False
+
+    # Сначала слияния (по значению в рамке), потом куски (по маске), потом сам rect
+    for i, (value, _, box, split) in enumerate(nodes):
+        target = group_label[component[m + i]]
+        if split is None and target != value:
+            by0, by1, bx0, bx1 = box
+            cells = layer[by0:by1, bx0:bx1]
+            cells[cells == value] = target
+            write_region(layer, by0, bx0, cells)
+    for i, (value, _, box, split) in enumerate(nodes):
+        target = group_label[component[m + i]]
+        if split is not None and target != value:
+            pieces, piece, (wy0, _, wx0, _) = split
+            cells = layer[wy0:wy0 + pieces.shape[0], wx0:wx0 + pieces.shape[1]]
+            cells[pieces == piece] = target
+            write_region(layer, wy0, wx0, cells)
+    lut = np.zeros(m + 1, dtype=layer.dtype)
+    lut[1:] = group_label[component[:m]]
+    write_region(layer, y0, x0, lut[local[inner].reshape(y1 - y0, x1 - x0)])
+
+    # Размеры и рамки затронутых меток
+    if total >= len(sizes):
+        sizes = np.concatenate([sizes, np.zeros(total + 1 - len(sizes), dtype=sizes.dtype)])
+        bbox = np.concatenate([bbox, np.full((total + 1 - len(bbox), 4), -1, dtype=bbox.dtype)])
+    for value in freed:
+        sizes[value] = 0
+        bbox[value] = -1
+    node_sizes = np.array([node[1] for node in nodes], dtype=np.int64)
+    node_boxes = np.array([node[2] for node in nodes], dtype=np.int64).reshape(-1, 4)
+    group_sizes = np.zeros(groups, dtype=np.int64)
+    np.add.at(group_sizes, component[:m], local_sizes[1:])
+    np.add.at(group_sizes, component[m:], node_sizes)
+    lo = np.full((groups, 2), np.iinfo(np.int64).max)
+    hi = np.full((groups, 2), -1)
+    for part, boxes in ((component[:m], local_boxes[1:]), (component[m:], node_boxes)):
+        np.minimum.at(lo, part, boxes[:, [0, 2]])
+        np.maximum.at(hi, part, boxes[:, [1, 3]])
+    has_nodes = np.zeros(groups, dtype=bool)
+    has_nodes[component[m:]] = True
+    for g in range(groups):
+        value = group_label[g]
+        box = (lo[g, 0], hi[g, 0], lo[g, 1], hi[g, 1])
+        sizes[value] = group_sizes[g]
+        # Рамка области целиком внутри rect точна; со старыми частями — надмножество
+        bbox[value] = _shrink_box(layer, value, box) if has_nodes[g] else box
+    for name, data in ((f"{prefix}_sizes", sizes), (f"{prefix}_bbox", bbox)):
+        del group[name]
+        group.create_dataset(name, data=data)
+    return True
+
+
+def update_indexes(f, biome, rect, old_biome):
+    """
+    Обновляет группу index после правки rect = (y0, y1, x0, x1).
+    biome: (H, W) коды биомов после правки; old_biome: коды rect до правки.
+    Если метки материков/океанов не влезают в тип набора — пересборка целиком.
+    """
+    group = f["index"]
+    n = len(BIOME_NAMES)
+    shape = biome.shape
+    y0, y1, x0, x1 = rect
+    for prefix, layer_name, water in (("continent", "continents", False), ("ocean", "oceans", True)):
+        if not _update_components(group, prefix, layer_name, biome, rect, water):
+            write_indexes(f, biome)
+            return
+
+    # Биомы: счётчики и рамки
+    new = np.asarray(biome[y0:y1, x0:x1])
+    old_biome = np.asarray(old_biome)
+    biome_count = group["biome_count"][()]
+    biome_count += np.bincount(new.ravel(), minlength=n) - np.bincount(old_biome.ravel(), minlength=n)
+    biome_bbox = group["biome_bbox"][()]
+    for code in np.union1d(old_biome, new).tolist():
+        box = tuple(biome_bbox[code])
+        ys, xs = np.nonzero(new == code)
+        if len(ys):
+            box = _box_union(box, (y0 + ys.min(), y0 + ys.max() + 1, x0 + xs.min(), x0 + xs.max() + 1))
+        biome_bbox[code] = _shrink_box(biome, code, box)
+    group["biome_count"][...] = biome_count
+    group["biome_bbox"][...] = biome_bbox
+
+    # Берег и границы меняются в rect и на кольце вокруг; соседи — ещё на клетку дальше
+    window = _expand(rect, 1, shape)
+    by0, by1, bx0, bx1 = _expand(rect, 2, shape)
+    block = np.asarray(biome[by0:by1, bx0:bx1])
+    core = (slice(window[0] - by0, window[1] - by0), slice(window[2] - bx0, window[3] - bx0))
+    offset = np.array([window[0], window[2]], dtype=np.int32)
+    water_block = np.isin(block, WATER_BIOMES)
+    coast = np.argwhere((~water_block & _differs_from_neighbour(water_block))[core]).astype(np.int32) + offset
+    coastline = group["coastline"][()]
+    coastline, _ = _replace_points(coastline, np.zeros(len(coastline)), window, coast, np.zeros(len(coast)), shape)
+
+    offsets = group["border_offsets"][()]
+    cells = np.argwhere(_differs_from_neighbour(block)[core]).astype(np.int32)
+    border, codes = _replace_points(group["border"][()], np.repeat(np.arange(n), np.diff(offsets)), window,
+                                    cells + offset, block[core][cells[:, 0], cells[:, 1]], shape)
+    offsets[1:] = np.cumsum(np.bincount(codes, minlength=n))
+    for name, data in (("coastline", coastline), ("border", border)):
+        del group[name]
+        group.create_dataset(name, data=data)
+    group["border_offsets"][...] = offsets
+
+
+class WorldIndex:
+    """
+    Запросы по индексам из world_data.h5 (WorldFile). В память при первом
+    обращении читаются только таблицы по меткам (размеры, рамки, смещения границ);
+    сетки H×W (материки, океаны, биомы) читаются поклеточно из HDF5, границы
+    биома — своим отрезком. Координаты в API — (x, y), как у Cell.
+    """
+    def __init__(self, world):
+        if "index" not in world:
+            raise KeyError("World file has no spatial index (re-export with export_hdf5)")
+        self.world = world
+        self.group = world["index"]
+        self._data = {}
+        self._grids = {}
+        self._trees = {}
+
+    def _get(self, name):
+        if name not in self._data:
+            self._data[name] = self.group[name][()]
+        return self._data[name]
+
+    def _cell(self, name, x, y):
+        # Наборы держатся открытыми: у каждого свой чанк-кэш h5py
+        if name not in self._grids:
+            self._grids[name] = self.world["biome"] if name == "biome" else self.group[name]
+        return self._grids[name][y, x]
+
+    # --- материки и океаны
+    def continent_at(self, x, y):
+        """Метка материка (1..N) или 0, если клетка — вода."""
+        return int(self._cell("continents", x, y))
+
+    def ocean_at(self, x, y):
+        return int(self._cell("oceans", x, y))
+
+    @property
+    def continent_count(self):
+        # Метки, освободившиеся при правках, имеют размер 0
+        return int(np.count_nonzero(self._get("continent_sizes")))
+
+    @property
+    def ocean_count(self):
+        return int(np.count_nonzero(self._get("ocean_sizes")))
+
+    def continent_size(self, label):
+        return int(self._get("continent_sizes")[label])
+
+    def continent_bbox(self, label):
+        """(x0, y0, x1, y1), правая/нижняя граница не включается."""
+        y0, y1, x0, x1 = self._get("continent_bbox")[label]
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def ocean_size(self, label):
+        return int(self._get("ocean_sizes")[label])
+
+    def ocean_bbox(self, label):
+        y0, y1, x0, x1 = self._get("ocean_bbox")[label]
+        return int(x0), int(y0), int(x1), int(y1)
+
+    # --- берег
+    def coastline(self):
+        """(N, 2) массив [x, y] прибрежных клеток суши."""
+        return self._get("coastline")[:, ::-1]
+
+    # --- биомы
+    def biome_count(self, name):
+        return int(self._get("biome_count")[BIOME_CODE[name]])
+
+    def biome_bbox(self, name):
+        """(x0, y0, x1, y1) или None, если биома нет."""
+        y0, y1, x0, x1 = self._get("biome_bbox")[BIOME_CODE[name]]
+        if y0 < 0:
+            return None
+        return int(x0), int(y0), int(x1), int(y1)
+
+    def _tree(self, code):
+        if code not in self._trees:
+            from scipy.spatial import cKDTree
+            offsets = self._get("border_offsets")
+            coords = self.group["border"][offsets[code]:offsets[code + 1]]
+            self._trees[code] = cKDTree(coords) if len(coords) else None
+        return self._trees[code]
+
+    def nearest_biome(self, name, x, y):
+        """
+        Ближайшая к (x, y) клетка биома name: (x, y, расстояние) или None.
+        Если клетка сама этого биома — она же с расстоянием 0.
+        """
+        code = BIOME_CODE[name]
+        if self._cell("biome", x, y) == code:
+            return x, y, 0.0
+        tree = self._tree(code)
+        if tree is None:
+            return None
+        distance, i = tree.query((y, x))
+        ny, nx = tree.data[i]
+        return int(nx), int(ny), float(distance)
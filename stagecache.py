@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import pickle
+
+# -----------------------------
+# Кэш результатов стадий на диске
+# -----------------------------
+# Ключ стадии — sha256 от имени стадии, её параметров и ключа предыдущей
+# стадии, поэтому смена параметра пересчитывает только эту стадию и всё,
+# что ниже по конвейеру. CACHE_VERSION меняется при изменении алгоритмов.
+CACHE_VERSION = 3
+
+
+class StageCache:
+    """
+    Файлы <стадия>-<ключ>.pkl в directory. При превышении max_bytes удаляются
+    давно не использованные записи (по mtime; попадание обновляет mtime).
+    """
+    def __init__(self, directory=".world_cache", max_bytes=2 * 1024**3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(stage, params, upstream=None):
+        blob = json.dumps({"stage": stage, "params": params, "upstream": upstream, "version": CACHE_VERSION},
+                          sort_keys=True, default=repr)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, f"{stage}-{key}.pkl")
+
+    def get(self, stage, key):
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                payload = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return payload
+
+    def put(self, stage, key, payload):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(stage, key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                st = os.stat(os.path.join(self.directory, name))
+                entries.append((st.st_mtime, st.st_size, name))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.directory, name))
+            total -= size
+
+    def invalidate(self, stage=None):
+        """Удалить все записи или только записи одной стадии."""
+        for _, _, name in self._entries():
+            if stage is None or name.startswith(f"{stage}-"):
+                os.remove(os.path.join(self.directory, name))
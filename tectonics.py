@@ -1,66 +1,160 @@
 import numpy as np
 import random
 import heapq
-from noise import pnoise2
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from noisefield import noise_grid, noise_field
+from rng import item_generator
+import profiling
+
+CRUST_CHOICES = ["continental", "oceanic", "mixed"]
+CRUST_WEIGHTS = [0.35, 0.4, 0.25]
+
+# -----------------------------
+# Плиты на грубой сетке (тайловый режим для карт больше памяти)
+# -----------------------------
+# Плиты растут на сетке в factor раз мельче, полная карта плит не собирается:
+# клетка берёт метку грубой клетки в точке, сдвинутой шумом, чтобы границы плит
+# не шли ступеньками по factor клеток. Метка зависит только от координат клетки,
+# поэтому окна соседних тайлов совпадают на швах.
+WARP_SCALE = 4        # масштаб шума сдвига, грубых клеток
+WARP_AMPLITUDE = 1.0  # наибольший сдвиг, грубых клеток
+WARP_BASES = (1, 2)   # base шума для сдвига по x и y (0 занят стоимостью роста)
+
+
+def coarse_shape(width, height, factor):
+    # (H, W) грубой сетки
+    return -(-height // factor), -(-width // factor)
+
+
+def upsample_plates(coarse, factor, origin, size):
+    """
+    Окно карты плит полного разрешения по карте на грубой сетке.
+    coarse: (H/factor, W/factor), массив или memmap — читается только нужная часть
+    origin: (x0, y0) окна в клетках мира, size: (W, H) окна
+    """
+    x0, y0 = origin
+    width, height = size
+    if factor == 1:
+        return np.array(coarse[y0:y0 + height, x0:x0 + width])
+    coarse_h, coarse_w = coarse.shape
+    reach = WARP_AMPLITUDE * factor
+    cy0 = max(0, int((y0 - reach) // factor))
+    cx0 = max(0, int((x0 - reach) // factor))
+    cy1 = min(coarse_h, int((y0 + height - 1 + reach) // factor) + 1)
+    cx1 = min(coarse_w, int((x0 + width - 1 + reach) // factor) + 1)
+    window = np.array(coarse[cy0:cy1, cx0:cx1])
+
+    cells = []
+    for start, length, limit, low, base, axis in ((x0, width, coarse_w, cx0, WARP_BASES[0], 1),
+                                                  (y0, height, coarse_h, cy0, WARP_BASES[1], 0)):
+        shift = noise_field(origin, size, scale=WARP_SCALE * factor, octaves=3, seed=base)
+        np.clip(shift, -1, 1, out=shift)
+        shift *= reach
+        coords = np.expand_dims(start + np.arange(length), 1 - axis) + shift
+        del shift
+        coords //= factor
+        np.clip(coords, 0, limit - 1, out=coords)
+        cells.append(coords.astype(np.intp) - low)
+        del coords
+    return window[cells[1], cells[0]]
 
 class TectonicPlate:
-    def __init__(self, plate_id):
+    def __init__(self, plate_id, rng=None):
+        # rng: numpy Generator — свой поток плиты (rng.item_generator);
+        # None — глобальный random в прежнем порядке
         self.id = plate_id
+        uniform = random.uniform if rng is None else rng.uniform
 
         # Тип коры
-        self.crust_type = random.choices(
-            ["continental", "oceanic", "mixed"],
-            weights=[0.35, 0.4, 0.25]
-        )[0]
+        if rng is None:
+            self.crust_type = random.choices(CRUST_CHOICES, weights=CRUST_WEIGHTS)[0]
+        else:
+            self.crust_type = CRUST_CHOICES[rng.choice(len(CRUST_CHOICES), p=CRUST_WEIGHTS)]
 
         # Толщина и плотность
         if self.crust_type == "continental":
-            self.thickness_km = random.uniform(120, 200)
+            self.thickness_km = uniform(120, 200)
             self.density = 2.7
         elif self.crust_type == "oceanic":
-            self.thickness_km = random.uniform(15, 40)
+            self.thickness_km = uniform(15, 40)
             self.density = 3.0
         else:
-            self.thickness_km = random.uniform(60, 140)
-            self.density = random.uniform(2.7, 3.0)
+            self.thickness_km = uniform(60, 140)
+            self.density = uniform(2.7, 3.0)
 
         # Скорость и направление
-        speed_cm_year = random.uniform(1, 10)
-        angle = random.uniform(0, 2 * np.pi)
+        speed_cm_year = uniform(1, 10)
+        angle = uniform(0, 2 * np.pi)
         self.velocity = np.array([np.cos(angle), np.sin(angle)]) * speed_cm_year
 
         # Возраст океанической коры
         if self.crust_type == "oceanic":
-            self.oceanic_age_myr = random.uniform(0, 180)
+            self.oceanic_age_myr = uniform(0, 180)
         else:
             self.oceanic_age_myr = None
 
 class TectonicsGenerator:
-    def __init__(self, width=200, height=200, plates_count=5, noise_scale=0.04, noise_strength=500.0, seed=None):
+    GROWTH_ENGINES = ("csgraph", "heap")
+
+    def __init__(self, width=200, height=200, plates_count=5, noise_scale=0.04, noise_strength=500.0, seed=None,
+                 growth="csgraph"):
         self.WIDTH = width
         self.HEIGHT = height
         self.PLATES_COUNT = plates_count
         self.NOISE_SCALE = noise_scale
         self.NOISE_STRENGTH = noise_strength
 
+        # csgraph: скомпилированный Dijkstra из scipy; heap: исходный цикл на heapq
+        if growth not in self.GROWTH_ENGINES:
+            raise ValueError(f"Unknown growth engine: {growth}")
+        self.GROWTH = growth
+
+        # seed: плиты и их seed-клетки берутся из потоков rng.item_generator по номеру
+        # плиты и не зависят от порядка создания и от числа плит. Глобальный random
+        # по-прежнему засевается — на нём работает WorldGenerator(seed=None).
+        self.SEED = seed
         if seed is not None:
             random.seed(seed)
             np.random.seed(seed)
-
-        self.plates = [TectonicPlate(i) for i in range(self.PLATES_COUNT)]
+            self.plates = [TectonicPlate(i, item_generator(seed, "plate", i)) for i in range(self.PLATES_COUNT)]
+        else:
+            self.plates = [TectonicPlate(i) for i in range(self.PLATES_COUNT)]
         self.plate_map = -np.ones((self.HEIGHT, self.WIDTH), dtype=int)
+        self.cost_map = None
 
     def generate(self):
-        cost_map = np.full((self.HEIGHT, self.WIDTH), np.inf)
-        pq = []
-
         # Seed каждой плиты
+        seeds = []
         for plate in self.plates:
-            x = random.randint(0, self.WIDTH - 1)
-            y = random.randint(0, self.HEIGHT - 1)
-            self.plate_map[y, x] = plate.id
+            if self.SEED is None:
+                x = random.randint(0, self.WIDTH - 1)
+                y = random.randint(0, self.HEIGHT - 1)
+            else:
+                x, y = (int(v) for v in item_generator(self.SEED, "plate_seed", plate.id).integers(0, (self.WIDTH, self.HEIGHT)))
+            seeds.append((x, y, plate.id))
+
+        # Стоимость шага в клетку: одно поле шума на всю карту
+        noise_map = noise_grid(np.arange(self.WIDTH) * self.NOISE_SCALE,
+                               np.arange(self.HEIGHT) * self.NOISE_SCALE, octaves=4)
+        step_cost_map = 1.0 + np.abs(noise_map.astype(np.float64)) * self.NOISE_STRENGTH
+
+        if self.GROWTH == "heap":
+            self.cost_map = self._grow_heap(seeds, step_cost_map)
+        else:
+            self.cost_map = self._grow_csgraph(seeds, step_cost_map)
+
+        return self.plate_map, self.plates
+
+    def _grow_heap(self, seeds, step_cost_map):
+        cost_map = np.full((self.HEIGHT, self.WIDTH), np.inf)
+        pq = []
+        pushes = 0
+        for x, y, plate_id in seeds:
+            self.plate_map[y, x] = plate_id
             cost_map[y, x] = 0.0
-            heapq.heappush(pq, (0.0, x, y, plate.id))
+            heapq.heappush(pq, (0.0, x, y, plate_id))
+            pushes += 1
 
         # Multi-source Dijkstra для роста плит
         while pq:
@@ -72,15 +166,79 @@ class TectonicsGenerator:
                 nx, ny = x + dx, y + dy
                 if 0 <= nx < self.WIDTH and 0 <= ny < self.HEIGHT:
                     if self.plate_map[ny, nx] == -1:
-                        noise_val = pnoise2(nx * self.NOISE_SCALE, ny * self.NOISE_SCALE, octaves=4)
-                        step_cost = 1.0 + abs(noise_val) * self.NOISE_STRENGTH
-                        new_cost = cost + step_cost
+                        new_cost = cost + step_cost_map[ny, nx]
                         if new_cost < cost_map[ny, nx]:
                             cost_map[ny, nx] = new_cost
                             self.plate_map[ny, nx] = plate_id
                             heapq.heappush(pq, (new_cost, nx, ny, plate_id))
+                            pushes += 1
 
-        return self.plate_map, self.plates
+        profiling.count("heap_pushes", pushes)
+        return cost_map
+
+    def _grow_csgraph(self, seeds, step_cost_map):
+        # Клетка получает стоимость только при первом достижении, а шаг зависит
+        # лишь от клетки-цели, поэтому heap-версия — обычный Dijkstra с весом
+        # ребра m -> n, равным step_cost_map[n]. Считаем его по всему графу сразу.
+        n = self.HEIGHT * self.WIDTH
+        index_dtype = np.int32 if 4 * n < np.iinfo(np.int32).max else np.int64
+        idx = np.arange(n, dtype=index_dtype).reshape(self.HEIGHT, self.WIDTH)
+
+        # CSR собирается напрямую: соседи клетки по возрастанию номера
+        # (сверху, слева, справа, снизу), без промежуточных COO-массивов
+        neighbours = np.full((self.HEIGHT, self.WIDTH, 4), -1, dtype=index_dtype)
+        neighbours[1:, :, 0] = idx[:-1, :]
+        neighbours[:, 1:, 1] = idx[:, :-1]
+        neighbours[:, :-1, 2] = idx[:, 1:]
+        neighbours[:-1, :, 3] = idx[1:, :]
+        neighbours = neighbours.reshape(n, 4)
+        indptr = np.zeros(n + 1, dtype=index_dtype)
+        np.cumsum((neighbours >= 0).sum(axis=1), out=indptr[1:])
+        indices = neighbours[neighbours >= 0]
+        del neighbours
+        graph = csr_matrix((step_cost_map.ravel()[indices], indices, indptr), shape=(n, n))
+        del indices, indptr
+        profiling.count("graph_edges", graph.nnz)
+
+        # При совпадении seed-клеток окрестность достаётся плите с меньшим id
+        source_plate = {}
+        for x, y, plate_id in seeds:
+            node = y * self.WIDTH + x
+            source_plate[node] = min(plate_id, source_plate.get(node, plate_id))
+        nodes = np.array(sorted(source_plate), dtype=np.int32)
+        node_plate = np.full(idx.size, -1, dtype=np.int32)
+        node_plate[nodes] = [source_plate[n] for n in nodes]
+
+        dist = dijkstra(graph, directed=True, indices=nodes, min_only=True).reshape(self.HEIGHT, self.WIDTH)
+        del graph
+
+        # Метку клетке даёт сосед, извлечённый из кучи первым, т.е. минимум
+        # по (cost, x, y): слева < сверху < снизу < справа при равной стоимости
+        parent = idx.copy()
+        best = np.full(dist.shape, np.inf)
+        for dy, dx in [(0,-1),(-1,0),(1,0),(0,1)]:
+            ys = slice(max(dy, 0), self.HEIGHT + min(dy, 0))
+            xs = slice(max(dx, 0), self.WIDTH + min(dx, 0))
+            yt = slice(max(-dy, 0), self.HEIGHT + min(-dy, 0))
+            xt = slice(max(-dx, 0), self.WIDTH + min(-dx, 0))
+            better = dist[ys, xs] < best[yt, xt]
+            best[yt, xt] = np.where(better, dist[ys, xs], best[yt, xt])
+            parent[yt, xt] = np.where(better, idx[ys, xs], parent[yt, xt])
+        parent = parent.ravel()
+        parent[nodes] = nodes
+
+        # Pointer jumping до seed-клеток
+        while True:
+            grand = parent[parent]
+            if np.array_equal(grand, parent):
+                break
+            parent = grand
+
+        self.plate_map[:] = node_plate[parent].reshape(self.HEIGHT, self.WIDTH)
+        for x, y, plate_id in seeds:
+            self.plate_map[y, x] = plate_id
+
+        return dist.reshape(self.HEIGHT, self.WIDTH)
 
     def visualize(self):
         import matplotlib.pyplot as plt
@@ -0,0 +1,188 @@
+import os
+import shutil
+import tempfile
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from PIL import Image
+from tectonics import TectonicsGenerator, coarse_shape, upsample_plates
+from pipeline import TECTONICS_BYTES_PER_TILE, available_memory
+from world import WorldGenerator, BIOME_COLORS, HALO, TERRAIN_REACH
+from spatial import write_indexes
+from worldfile import create_world_file, create_layer, write_region, create_pyramid, build_pyramid
+import noisefield
+import profiling
+
+# -----------------------------
+# Тайловая генерация больших карт
+# -----------------------------
+# Плиты растут глобально (кратчайшие пути не локальны), plate_map кладётся
+# на диск как .npy и читается воркерами через memmap. Остальные стадии
+# считаются по тайлам с полями (halo) в пуле процессов, а родитель пишет
+# готовые тайлы в чанкованные наборы HDF5 по мере готовности.
+# Ширина поля — world.HALO, но не меньше TERRAIN_REACH + steps (смешивание цветов).
+#
+# Рост плит берёт ~TECTONICS_BYTES_PER_TILE байт на клетку (21 ГиБ на 16k²).
+# Если столько нет, плиты растут на сетке в plate_factor раз мельче, и воркеры
+# восстанавливают окно карты плит сами (tectonics.upsample_plates) — тогда
+# предела на размер карты по памяти нет, кроме PNG (W*H*3 байт в родителе).
+TILE = 1024
+# Пик воркера на клетку окна тайла вместе с интерпретатором и смешиванием цветов;
+# измерено по VmHWM на окне 1280²
+WORKER_BYTES_PER_TILE = 120
+
+_WORKER = {}
+
+
+def _init_worker(plate_map_path, plate_factor, plates, world_size, seed, halo, steps):
+    # Параллелизм — на уровне тайлов
+    noisefield.MAX_WORKERS = 1
+    _WORKER.update(
+        plate_map=np.load(plate_map_path, mmap_mode="r"),
+        plate_factor=plate_factor,
+        plates=plates,
+        world_size=world_size,
+        seed=seed,
+        halo=halo,
+        steps=steps,
+    )
+
+
+def _generate_tile(bounds):
+    y0, y1, x0, x1 = bounds
+    width, height = _WORKER["world_size"]
+    halo = _WORKER["halo"]
+    wy0, wy1 = max(0, y0 - halo), min(height, y1 + halo)
+    wx0, wx1 = max(0, x0 - halo), min(width, x1 + halo)
+
+    window = upsample_plates(_WORKER["plate_map"], _WORKER["plate_factor"], (wx0, wy0), (wx1 - wx0, wy1 - wy0))
+    world_gen = WorldGenerator(width=wx1 - wx0, height=wy1 - wy0, plate_map=window, plates=_WORKER["plates"],
+                               origin=(wx0, wy0), world_size=(width, height), seed=_WORKER["seed"])
+    world_gen.create_base_world()
+    world_gen.detect_boundaries()
+    world_gen.apply_terrain()
+    world_gen.assign_biomes()
+
+    core = (slice(y0 - wy0, y1 - wy0), slice(x0 - wx0, x1 - wx0))
+    layers = {name: (data[core], dtype) for name, (data, dtype) in world_gen.hdf5_layers().items()}
+    image = world_gen.blended_image(steps=_WORKER["steps"])[core]
+    return bounds, layers, image
+
+
+def tile_bounds(width, height, tile=TILE):
+    return [(y0, min(y0 + tile, height), x0, min(x0 + tile, width))
+            for y0 in range(0, height, tile) for x0 in range(0, width, tile)]
+
+
+def plan_memory(width, height, tile, halo, workers, png=False, memory_budget=None, plate_factor=None):
+    """
+    (plate_factor, workers) под бюджет памяти (байты; None — доступная память).
+    plate_factor — во сколько раз мельче сетка роста плит; None — наименьший, что влезает.
+    ValueError, если не влезает даже один воркер, PNG или рост плит с заданным plate_factor.
+    """
+    if memory_budget is None:
+        memory_budget = available_memory()
+    if memory_budget is None:
+        return plate_factor or 1, workers
+    budget_mib = memory_budget / 2**20
+
+    image_bytes = width * height * 3 if png else 0
+    window = min(width, tile + 2 * halo), min(height, tile + 2 * halo)
+    worker_bytes = window[0] * window[1] * WORKER_BYTES_PER_TILE
+    if image_bytes + worker_bytes > memory_budget:
+        raise ValueError(f"{width}x{height} needs at least {(image_bytes + worker_bytes) / 2**20:.0f} MiB "
+                         f"(PNG {image_bytes / 2**20:.0f} MiB, one tile worker {worker_bytes / 2**20:.0f} MiB), "
+                         f"budget is {budget_mib:.0f} MiB")
+    fit = max(1, (memory_budget - image_bytes) // worker_bytes)
+    if fit < workers:
+        print(f"[WARN] Memory budget fits {fit} tile workers of {workers}")
+        workers = fit
+
+    def growth_bytes(factor):
+        return int(np.prod(coarse_shape(width, height, factor))) * TECTONICS_BYTES_PER_TILE
+
+    if plate_factor is None:
+        plate_factor = 1
+        while growth_bytes(plate_factor) > memory_budget:
+            plate_factor += 1
+        if plate_factor > 1:
+            print(f"[WARN] Plate growth for {width}x{height} does not fit in {budget_mib:.0f} MiB, "
+                  f"growing plates on a {plate_factor}x coarser grid")
+    elif growth_bytes(plate_factor) > memory_budget:
+        raise ValueError(f"Plate growth for {width}x{height} (plate_factor={plate_factor}) needs "
+                         f"{growth_bytes(plate_factor) / 2**20:.0f} MiB, budget is {budget_mib:.0f} MiB")
+    return plate_factor, workers
+
+
+def generate_tiled(width, height, plates_count, seed=0, filename="world_data.h5", png_filename=None,
+                   tile=TILE, halo=None, workers=None, steps=3, compression="gzip", memory_budget=None,
+                   plate_factor=None):
+    """
+    Генерация мира по тайлам в пуле процессов с потоковой записью в HDF5.
+    Совпадает с WorldGenerator(..., seed=seed) побитно (halo=None — поле по умолчанию),
+    если плиты растут в полном разрешении (plate_factor=1).
+    png_filename: если задан, собирается и PNG с градиентами (занимает W*H*3 байт в памяти)
+    memory_budget: байты (None — доступная память); под него подбираются
+                   plate_factor (если None) и число воркеров, см. plan_memory
+    Пирамида карты пишется в HDF5 всегда, по тайлам.
+    """
+    if halo is None:
+        halo = max(HALO, TERRAIN_REACH + steps)
+    workers = workers or os.cpu_count() or 1
+    plate_factor, workers = plan_memory(width, height, tile, halo, workers, png_filename is not None,
+                                        memory_budget, plate_factor)
+
+    grid_height, grid_width = coarse_shape(width, height, plate_factor)
+    tectonics_gen = TectonicsGenerator(width=grid_width, height=grid_height, plates_count=plates_count, seed=seed)
+    tectonics_gen.NOISE_SCALE *= plate_factor
+    plate_map, plates = tectonics_gen.generate()
+    print(f"[INFO] Plates grown ({plates_count}, grid {grid_width}x{grid_height})")
+
+    tmp_dir = tempfile.mkdtemp(prefix="tiles_", dir=os.path.dirname(os.path.abspath(filename)))
+    plate_map_path = os.path.join(tmp_dir, "plate_map.npy")
+    np.save(plate_map_path, plate_map.astype(np.int32))
+    del plate_map, tectonics_gen
+
+    tiles = iter(tile_bounds(width, height, tile))
+    image = Image.new("RGB", (width, height)) if png_filename else None
+
+    try:
+        with create_world_file(filename, width, height) as f, ProcessPoolExecutor(
+                max_workers=workers, initializer=_init_worker,
+                initargs=(plate_map_path, plate_factor, plates, (width, height), seed, halo, steps)) as pool:
+            # Не больше 2*workers тайлов в полёте, чтобы память не росла с размером карты
+            pending = set()
+            for bounds in tiles:
+                pending.add(pool.submit(_generate_tile, bounds))
+                if len(pending) >= 2 * workers:
+                    break
+
+            datasets = {}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    (y0, y1, x0, x1), layers, tile_image = future.result()
+                    for name, (data, dtype) in layers.items():
+                        if name not in datasets:
+                            datasets[name] = create_layer(f, name, (height, width), dtype, compression=compression)
+                        write_region(datasets[name], y0, x0, data)
+                    if "color" not in datasets:
+                        datasets["color"] = create_pyramid(f, steps=steps, compression=compression)
+                    write_region(datasets["color"], y0, x0, tile_image)
+                    if image is not None:
+                        image.paste(Image.fromarray(tile_image), (x0, y0))
+                    profiling.count("tiles_processed", (y1 - y0) * (x1 - x0))
+
+                    bounds = next(tiles, None)
+                    if bounds is not None:
+                        pending.add(pool.submit(_generate_tile, bounds))
+
+            f["biome"].attrs["colors"] = BIOME_COLORS
+            build_pyramid(f, compression=compression)
+            write_indexes(f, f["biome"], compression=compression)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print(f"[INFO] World data exported to {filename}")
+    if image is not None:
+        image.save(png_filename)
+        print(f"[INFO] World PNG exported to {png_filename}")
@@ -1,183 +1,568 @@
+import os
 import numpy as np
 import random
 from scipy.ndimage import gaussian_filter, distance_transform_edt
-import noise
-import h5py
-from PIL import Image
+from noisefield import noise_field
+from rng import block_uniform
+import profiling
 from map import MapVisualizer
 
+# -----------------------------
+# Коды для колоночного хранения мира
+# -----------------------------
+CRUST_TYPES = ["continental", "oceanic", "mixed"]
+CRUST_CODE = {name: code for code, name in enumerate(CRUST_TYPES)}
+
+BOUNDARY_TYPES = [None, "convergent", "divergent", "transform"]
+BOUNDARY_CODE = {name: code for code, name in enumerate(BOUNDARY_TYPES)}
+
+# Правила биомов: проверяются сверху вниз, первое совпавшее побеждает.
+# Условия — открытые интервалы (min, max), None — без границы.
+# Код — значение в массиве biome и в enum HDF5; при добавлении биома
+# достаточно новой строки с новым кодом.
+BIOME_TABLE = [
+    # имя                код  цвет             высота         температура  влажность
+    ("mountain",          3, (120,110,100),   (2500, None),   None,        None),
+    ("deep_ocean",        1, (0,0,128),       (None, -2000),  None,        None),
+    ("shelf",             2, (0,0,255),       (None, 0),      None,        None),
+    ("tropical_forest",   4, (34,139,34),     None,           (0.6, None), (0.5, None)),
+    ("desert",            5, (237,201,175),   None,           (0.6, None), None),
+    ("temperate_forest",  6, (107,142,35),    None,           (0.3, None), (0.5, None)),
+    ("grassland",         7, (189,183,107),   None,           (0.3, None), None),
+    ("tundra",            8, (198,226,255),   None,           (0.1, None), None),
+    ("ice",               9, (255,255,255),   None,           None,        None),
+]
+BIOME_NAMES = [None] * (max(row[1] for row in BIOME_TABLE) + 1)
+BIOME_COLORS = np.zeros((len(BIOME_NAMES), 3), dtype=np.uint8)
+for _name, _code, _color, *_ in BIOME_TABLE:
+    BIOME_NAMES[_code] = _name
+    BIOME_COLORS[_code] = _color
+BIOME_CODE = {name: code for code, name in enumerate(BIOME_NAMES)}
+WATER_BIOMES = [BIOME_CODE["deep_ocean"], BIOME_CODE["shelf"]]
+
+
+def _rule_bounds(table):
+    # Каждое правило -> список границ вида (слой, ">"/"<", значение)
+    rules = []
+    for _, code, _, *bands in table:
+        bounds = []
+        for layer, band in zip(("height", "temp", "hum"), bands):
+            if band is None:
+                continue
+            lo, hi = band
+            if lo is not None:
+                bounds.append((layer, ">", lo))
+            if hi is not None:
+                bounds.append((layer, "<", hi))
+        rules.append((code, bounds))
+    return rules
+
+
+def classify_biomes(height, temp, hum, table=BIOME_TABLE):
+    """
+    Коды биомов (uint8) по таблице правил для всей сетки сразу.
+    Клетки, не подошедшие ни под одно правило, получают код 0.
+
+    Каждая различная граница из таблицы — один бит ключа клетки; таблица
+    заранее раскрывается в LUT «ключ -> код», так что на клетку приходится
+    по одному сравнению на границу и одна выборка из LUT.
+    """
+    layers = {"height": height, "temp": temp, "hum": hum}
+    rules = _rule_bounds(table)
+    bounds = sorted({bound for _, rule in rules for bound in rule}, key=repr)
+    bit = {bound: i for i, bound in enumerate(bounds)}
+    if len(bounds) > 16:
+        raise ValueError("Too many distinct biome bounds (max 16)")
+
+    lut = np.zeros(1 << len(bounds), dtype=np.uint8)
+    keys = np.arange(lut.size)
+    assigned = np.zeros(lut.size, dtype=bool)
+    for code, rule in rules:
+        need = sum(1 << bit[bound] for bound in rule)
+        match = ((keys & need) == need) & ~assigned
+        lut[match] = code
+        assigned |= match
+
+    key = np.zeros(height.shape, dtype=np.uint16)
+    for (layer, op, value), i in bit.items():
+        values = layers[layer]
+        mask = values > value if op == ">" else values < value
+        key |= mask.astype(np.uint16) << np.uint16(i)
+    return lut[key]
+
+
 class Cell:
-    def __init__(self, x, y):
+    """Представление одной клетки поверх массивов WorldGenerator (для старого кода)."""
+    __slots__ = ("_world", "x", "y")
+
+    def __init__(self, world, x, y):
+        self._world = world
         self.x = x
         self.y = y
-        self.plate_id = None
-        self.crust_type = None
-        self.is_boundary = False
-        self.boundary_type = None  # convergent/divergent/transform
-        self.height = 0.0
-        self.tile_type = None
-        self.color = (0,0,0)
-        self.moisture = 0.0
+
+    @property
+    def plate_id(self):
+        return int(self._world.plate_id[self.y, self.x])
+
+    @plate_id.setter
+    def plate_id(self, value):
+        self._world.plate_id[self.y, self.x] = value
+
+    @property
+    def crust_type(self):
+        return CRUST_TYPES[self._world.crust[self.y, self.x]]
+
+    @crust_type.setter
+    def crust_type(self, value):
+        self._world.crust[self.y, self.x] = CRUST_CODE[value]
+
+    @property
+    def is_boundary(self):
+        return bool(self._world.is_boundary[self.y, self.x])
+
+    @is_boundary.setter
+    def is_boundary(self, value):
+        self._world.is_boundary[self.y, self.x] = value
+
+    @property
+    def boundary_type(self):
+        return BOUNDARY_TYPES[self._world.boundary_type[self.y, self.x]]
+
+    @boundary_type.setter
+    def boundary_type(self, value):
+        self._world.boundary_type[self.y, self.x] = BOUNDARY_CODE[value]
+
+    @property
+    def height(self):
+        return float(self._world.height[self.y, self.x])
+
+    @height.setter
+    def height(self, value):
+        self._world.height[self.y, self.x] = value
+
+    @property
+    def moisture(self):
+        return float(self._world.moisture[self.y, self.x])
+
+    @moisture.setter
+    def moisture(self, value):
+        self._world.moisture[self.y, self.x] = value
+
+    @property
+    def tile_type(self):
+        return BIOME_NAMES[self._world.biome[self.y, self.x]]
+
+    @tile_type.setter
+    def tile_type(self, value):
+        self._world.biome[self.y, self.x] = BIOME_CODE[value]
+
+    @property
+    def color(self):
+        return tuple(int(c) for c in self._world.color[self.y, self.x])
+
+    @color.setter
+    def color(self, value):
+        self._world.color[self.y, self.x] = value
+
+
+class _RowView:
+    __slots__ = ("_world", "_y")
+
+    def __init__(self, world, y):
+        self._world = world
+        self._y = y
+
+    def __len__(self):
+        return self._world.WIDTH
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self._world.WIDTH
+        if not 0 <= x < self._world.WIDTH:
+            raise IndexError(x)
+        return Cell(self._world, x, self._y)
+
+    def __iter__(self):
+        return (Cell(self._world, x, self._y) for x in range(self._world.WIDTH))
+
+
+class WorldView:
+    """world[y][x] -> Cell, как у старого списка списков."""
+    __slots__ = ("_world",)
+
+    def __init__(self, world):
+        self._world = world
+
+    def __len__(self):
+        return self._world.HEIGHT
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self._world.HEIGHT
+        if not 0 <= y < self._world.HEIGHT:
+            raise IndexError(y)
+        return _RowView(self._world, y)
+
+    def __iter__(self):
+        return (_RowView(self._world, y) for y in range(self._world.HEIGHT))
+
+
+# Радиус влияния клетки на соседей при генерации (поля тайлов, инкрементальная перегенерация).
+# Спады по расстоянию обрезаются нулём на фиксированном радиусе, поэтому окно с полем
+# HALO даёт те же биты, что и весь мир:
+#   - границы плит: пары соседних клеток (1)
+#   - спад гор exp(-d/5)*4000 до MOUNTAIN_RADIUS (скачок на срезе 0.27 м)
+#   - gaussian_filter(sigma=1.5): радиус ядра BLUR_RADIUS
+#   - влажность exp(-d/30) до MOISTURE_RADIUS (скачок 0.12: с шумом ±0.1 ниже порога биомов 0.5)
+#   - смешивание цветов PNG: радиус steps — в тайлах поле растёт до TERRAIN_REACH + steps
+MOUNTAIN_RADIUS = 48
+MOISTURE_RADIUS = 64
+BLUR_RADIUS = 6
+TERRAIN_REACH = 1 + MOUNTAIN_RADIUS + BLUR_RADIUS + MOISTURE_RADIUS
+HALO = 128
+
+# Временные массивы самого тяжёлого шага (apply_terrain) на клетку сверх слоёв:
+# результат EDT float64, его внутренние int32-индексы (2, H, W), маски и шум.
+# Измерено по VmHWM на 2048² (profiling.Tracer, rss)
+PEAK_WORK_BYTES_PER_TILE = 36
+BLEND_BAND_TILES = 1 << 17  # клеток в полосе смешивания цветов (~22 МиБ временных массивов)
+
+
+def _global_random_fill(out, band=1 << 20):
+    """
+    out[...] = random.random() построчно, как цикл по клеткам, но одним
+    вызовом MT19937 numpy из состояния глобального random; состояние
+    потом возвращается в random. Непрерывный float64 пишется прямо в out,
+    иначе — полосами по band клеток.
+    """
+    version, internal, gauss = random.getstate()
+    bit_generator = np.random.MT19937()
+    bit_generator.state = {"bit_generator": "MT19937",
+                           "state": {"key": np.array(internal[:-1], dtype=np.uint32), "pos": internal[-1]}}
+    generator = np.random.Generator(bit_generator)
+    if out.dtype == np.float64 and out.flags.c_contiguous:
+        generator.random(out=out.reshape(-1))
+    else:
+        rows = max(1, band // out.shape[1])
+        for y in range(0, out.shape[0], rows):
+            out[y:y + rows] = generator.random(out[y:y + rows].shape)
+    state = bit_generator.state["state"]
+    random.setstate((version, tuple(int(k) for k in state["key"]) + (int(state["pos"]),), gauss))
+
+
+def _distance_to(mask):
+    # Расстояние до ближайшей клетки mask; inf, если таких клеток нет
+    if not mask.any():
+        return np.full(mask.shape, np.inf)
+    return distance_transform_edt(~mask)
+
 
 class WorldGenerator:
-    def __init__(self, width, height, plate_map, plates):
+    def __init__(self, width, height, plate_map, plates, origin=(0, 0), world_size=None, seed=None, buffers=None,
+                 compact=False):
+        """
+        width, height, plate_map: генерируемая область (весь мир или окно тайла)
+        origin: (x, y) левого верхнего угла области в координатах мира
+        world_size: (W, H) всего мира, по умолчанию совпадает с областью
+        seed: None — базовый рельеф из глобального random (как раньше);
+              число — из потоков rng.block_uniform, одинаковых для любой области
+        compact: политика типов для ограниченной памяти — height/moisture float32,
+                 plate_id int16 (см. layer_specs, estimate_peak_bytes)
+        """
         self.WIDTH = width
         self.HEIGHT = height
         self.plate_map = plate_map
         self.plates = plates
-        self.world = [[Cell(x, y) for x in range(self.WIDTH)] for y in range(self.HEIGHT)]
+        self.ORIGIN = origin
+        self.WORLD_SIZE = world_size or (width, height)
+        self.SEED = seed
+        self.COMPACT = compact
+        if compact and len(plates) > np.iinfo(np.int16).max:
+            raise ValueError("Compact mode supports at most 32767 plates")
+
+        # Колоночное хранение: один массив на атрибут клетки.
+        # buffers: имя -> готовый массив той же формы и dtype (например, в shared memory)
+        for name, layer_shape, dtype, fill in self.layer_specs(width, height, compact):
+            if buffers and name in buffers:
+                layer = buffers[name]
+                if layer.shape != layer_shape or layer.dtype != dtype:
+                    raise ValueError(f"Buffer {name} must be {dtype} {layer_shape}")
+                layer[...] = fill
+            else:
+                layer = np.full(layer_shape, fill, dtype=dtype)
+            setattr(self, name, layer)
+
+    @staticmethod
+    def layer_specs(width, height, compact=False):
+        # (имя, форма, dtype, начальное значение) массивов клеток
+        shape = (height, width)
+        real = np.float32 if compact else np.float64
+        return [
+            ("plate_id", shape, np.int16 if compact else np.int32, -1),
+            ("crust", shape, np.uint8, 0),
+            ("is_boundary", shape, bool, False),
+            ("boundary_type", shape, np.uint8, 0),
+            ("height", shape, real, 0),
+            ("moisture", shape, real, 0),
+            ("biome", shape, np.uint8, 0),
+            ("color", shape + (3,), np.uint8, 0),
+        ]
+
+    @classmethod
+    def estimate_peak_bytes(cls, width, height, compact=False):
+        """
+        Оценка пика памяти стадий WorldGenerator: слои, входной plate_map (int32)
+        и временные массивы apply_terrain.
+        """
+        layers = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize
+                     for _, shape, dtype, _ in cls.layer_specs(width, height, compact))
+        return layers + width * height * (4 + PEAK_WORK_BYTES_PER_TILE)
+
+    @property
+    def world(self):
+        return WorldView(self)
 
     # -----------------------------
     def create_base_world(self):
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                cell = self.world[y][x]
-                cell.plate_id = self.plate_map[y][x]
-                cell.crust_type = self.plates[cell.plate_id].crust_type
+        profiling.count("tiles_processed", self.WIDTH * self.HEIGHT)
+        self.plate_id[:] = self.plate_map
+        plate_crust = np.array([CRUST_CODE[p.crust_type] for p in self.plates], dtype=np.uint8)
+        self.crust[:] = plate_crust[self.plate_id]
 
     # -----------------------------
-    def detect_boundaries(self):
-        for y in range(self.HEIGHT-1):
-            for x in range(self.WIDTH-1):
-                cell = self.world[y][x]
-                neighbors = [self.world[y+1][x], self.world[y][x+1]]
-                for neighbor in neighbors:
-                    if cell.plate_id != neighbor.plate_id:
-                        cell.is_boundary = True
-                        neighbor.is_boundary = True
-
-                        plate_a = self.plates[cell.plate_id]
-                        plate_b = self.plates[neighbor.plate_id]
-                        relative_velocity = plate_a.velocity - plate_b.velocity
-                        normal = np.array([neighbor.x - cell.x, neighbor.y - cell.y])
-                        normal = normal / (np.linalg.norm(normal) + 1e-6)
-                        dot_product = np.dot(relative_velocity, normal)
-
-                        if dot_product > 0.5:
-                            b_type = "convergent"
-                        elif dot_product < -0.5:
-                            b_type = "divergent"
-                        else:
-                            b_type = "transform"
-
-                        cell.boundary_type = b_type
-                        neighbor.boundary_type = b_type
+    def detect_boundaries(self, wrap=False):
+        """
+        Классификация границ плит сразу по всей сетке.
+        wrap: замкнуть мир по x (цилиндрическая карта)
+        """
+        profiling.count("tiles_processed", self.WIDTH * self.HEIGHT)
+        pid = self.plate_id
+        velocity = np.array([p.velocity for p in self.plates], dtype=np.float64)  # (plates, 2)
+
+        # Пары клеток: (y,x)-(y+1,x) и (y,x)-(y,x+1)
+        down = self._pair_codes(velocity, pid[:-1, :], pid[1:, :], np.array([0.0, 1.0]))
+        if wrap:
+            right = self._pair_codes(velocity, pid, np.roll(pid, -1, axis=1), np.array([1.0, 0.0]))
+        else:
+            right = self._pair_codes(velocity, pid[:, :-1], pid[:, 1:], np.array([1.0, 0.0]))
+
+        # Тип клетки берётся от последней пары в построчном обходе:
+        # сосед сверху < сосед слева < своя пара вниз < своя пара вправо
+        b_type = np.zeros((self.HEIGHT, self.WIDTH), dtype=np.uint8)
+        np.copyto(b_type[1:, :], down, where=down > 0)
+        if wrap:
+            shifted = np.roll(right, 1, axis=1)
+            np.copyto(b_type, shifted, where=shifted > 0)
+        else:
+            np.copyto(b_type[:, 1:], right, where=right > 0)
+        np.copyto(b_type[:-1, :], down, where=down > 0)
+        np.copyto(b_type[:, :right.shape[1]], right, where=right > 0)
+
+        self.boundary_type[:] = b_type
+        self.is_boundary[:] = b_type > 0
+        return self.is_boundary, self.boundary_type
+
+    @staticmethod
+    def _pair_codes(velocity, plate_a, plate_b, normal):
+        codes = np.zeros(plate_a.shape, dtype=np.uint8)
+        mask = plate_a != plate_b
+        relative_velocity = velocity[plate_a[mask]] - velocity[plate_b[mask]]
+        dot_product = relative_velocity @ normal
+        codes[mask] = np.where(dot_product > 0.5, BOUNDARY_CODE["convergent"],
+                      np.where(dot_product < -0.5, BOUNDARY_CODE["divergent"],
+                               BOUNDARY_CODE["transform"]))
+        return codes
 
     # -----------------------------
     def apply_terrain(self):
-        base_height = np.zeros((self.HEIGHT, self.WIDTH))
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                cell = self.world[y][x]
-                if cell.crust_type == "continental":
-                    base_height[y,x] = random.uniform(0, 500)
-                else:
-                    base_height[y,x] = random.uniform(-4000, -2000)
+        # Все промежуточные массивы считаются на месте в self.height и одном буфере float64
+        profiling.count("tiles_processed", self.WIDTH * self.HEIGHT)
+        height = self.height
+        if self.SEED is None:
+            # random.random() в том же порядке, что и раньше (построчно)
+            _global_random_fill(height)
+        else:
+            x0, y0 = self.ORIGIN
+            block_uniform(self.SEED, "base_height", y0, y0 + self.HEIGHT, x0, x0 + self.WIDTH, out=height)
+        continental = self.crust == CRUST_CODE["continental"]
+        # суша 500*u, океан -4000 + 2000*u (умножение на 0.25 точное)
+        height *= 2000
+        np.multiply(height, 0.25, out=height, where=continental)
+        np.subtract(height, 4000, out=height, where=~continental)
 
         # Горные границы
-        mountain_mask = np.zeros((self.HEIGHT, self.WIDTH))
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                cell = self.world[y][x]
-                if cell.is_boundary and cell.boundary_type=="convergent":
-                    mountain_mask[y,x] = 1.0
-
-        distance = distance_transform_edt(1 - mountain_mask)
-        mountain_height = np.exp(-distance/5.0) * 4000
-        base_height += mountain_height
+        mountain_mask = self.is_boundary & (self.boundary_type == BOUNDARY_CODE["convergent"])
+        work = _distance_to(mountain_mask)
+        del mountain_mask
+        np.copyto(work, np.inf, where=work > MOUNTAIN_RADIUS)
+        work /= -5.0
+        np.exp(work, out=work)
+        work *= 4000
+        height += work
 
         # Размытие
-        height_array = gaussian_filter(base_height, sigma=1.5)
+        gaussian_filter(height, sigma=1.5, output=work)
+        height[:] = work
+        del work
 
         # Локальный шум для неровностей
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                cell = self.world[y][x]
-                scale = 20.0
-                if cell.crust_type == "continental":
-                    n = noise.pnoise2(x/scale, y/scale, octaves=3)
-                    height_array[y,x] += n*50
-                else:
-                    n = noise.pnoise2(x/scale, y/scale, octaves=2)
-                    height_array[y,x] += n*20
-
-        # Присвоение клеткам
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                self.world[y][x].height = height_array[y,x]
+        size = (self.WIDTH, self.HEIGHT)
+        scale = 20.0
+        noise = noise_field(self.ORIGIN, size, scale=scale, octaves=3).astype(height.dtype)
+        noise *= 50
+        ocean_noise = noise_field(self.ORIGIN, size, scale=scale, octaves=2).astype(height.dtype)
+        ocean_noise *= 20
+        np.copyto(noise, ocean_noise, where=~continental)
+        del ocean_noise
+        height += noise
 
     # -----------------------------
-    def assign_biomes(self):
-        ocean_mask = np.array([[1 if c.height >= 0 else 0 for c in row] for row in self.world])
-        distance_to_water = distance_transform_edt(ocean_mask)
+    def assign_biomes(self, table=BIOME_TABLE):
+        profiling.count("tiles_processed", self.WIDTH * self.HEIGHT)
+        work = _distance_to(self.height < 0)
+        np.copyto(work, np.inf, where=work > MOISTURE_RADIUS)
+        work /= -30.0
+        np.exp(work, out=work)
+        self.moisture[:] = work
+        hum = work.astype(self.moisture.dtype, copy=False)
+        del work
+
+        # шум для границ; temp собирается в том же массиве
+        x0, y0 = self.ORIGIN
+        lat = ((y0 + np.arange(self.HEIGHT)) / self.WORLD_SIZE[1]) * 180 - 90
         scale_noise = 10.0
+        temp = noise_field(self.ORIGIN, (self.WIDTH, self.HEIGHT), scale=scale_noise, octaves=2).astype(self.moisture.dtype)
+        temp *= 0.1
+        hum += temp
+        temp += (1 - np.abs(lat)/90)[:, None]
 
-        for y in range(self.HEIGHT):
-            for x in range(self.WIDTH):
-                cell = self.world[y][x]
-                cell.moisture = np.exp(-distance_to_water[y,x]/30.0)
-                lat = (y / self.HEIGHT) * 180 - 90
-                temp = 1 - abs(lat)/90
-                hum = cell.moisture
-
-                # шум для границ
-                n = noise.pnoise2(x/scale_noise, y/scale_noise, octaves=2)
-                temp += n*0.1
-                hum += n*0.1
-
-                if cell.height > 2500:
-                    cell.tile_type = "mountain"
-                    cell.color = (120,110,100)
-                elif cell.height < -2000:
-                    cell.tile_type = "deep_ocean"
-                    cell.color = (0,0,128)
-                elif cell.height < 0:
-                    cell.tile_type = "shelf"
-                    cell.color = (0,0,255)
-                else:
-                    if temp > 0.6:
-                        if hum > 0.5:
-                            cell.tile_type = "tropical_forest"
-                            cell.color = (34,139,34)
-                        else:
-                            cell.tile_type = "desert"
-                            cell.color = (237,201,175)
-                    elif temp > 0.3:
-                        if hum > 0.5:
-                            cell.tile_type = "temperate_forest"
-                            cell.color = (107,142,35)
-                        else:
-                            cell.tile_type = "grassland"
-                            cell.color = (189,183,107)
-                    else:
-                        if temp > 0.1:
-                            cell.tile_type = "tundra"
-                            cell.color = (198,226,255)
-                        else:
-                            cell.tile_type = "ice"
-                            cell.color = (255,255,255)
+        self.biome[:] = classify_biomes(self.height, temp, hum, table)
+        del temp, hum
+        np.take(BIOME_COLORS, self.biome, axis=0, out=self.color)
 
     # -----------------------------
     # Экспорт HDF5
     # -----------------------------
-    def export_hdf5(self, filename="world_data.h5"):
-        height_array = np.array([[c.height for c in row] for row in self.world], dtype=np.float32)
-        biome_array = np.array([[c.tile_type for c in row] for row in self.world], dtype='S')
-        crust_array = np.array([[c.crust_type for c in row] for row in self.world], dtype='S')
-        moisture_array = np.array([[c.moisture for c in row] for row in self.world], dtype=np.float32)
-
-        with h5py.File(filename, "w") as f:
-            f.create_dataset("height", data=height_array)
-            f.create_dataset("biome", data=biome_array)
-            f.create_dataset("crust_type", data=crust_array)
-            f.create_dataset("moisture", data=moisture_array)
+    def hdf5_layers(self, rect=None):
+        from worldfile import enum_dtype
+        # Наборы данных world_data.h5 (схема v2): имя -> (массив, dtype в файле)
+        # rect: (y0, y1, x0, x1) — только эта область
+        y0, y1, x0, x1 = rect or (0, self.HEIGHT, 0, self.WIDTH)
+        region = (slice(y0, y1), slice(x0, x1))
+        plate_dtype = np.int16 if len(self.plates) < np.iinfo(np.int16).max else np.int32
+        return {
+            "height": (self.height[region].astype(np.float32, copy=False), np.float32),
+            "moisture": (self.moisture[region].astype(np.float32, copy=False), np.float32),
+            "biome": (self.biome[region], enum_dtype(BIOME_NAMES)),
+            "crust_type": (self.crust[region], enum_dtype(CRUST_TYPES)),
+            "boundary_type": (self.boundary_type[region], enum_dtype(BOUNDARY_TYPES)),
+            "plate_map": (self.plate_id[region].astype(plate_dtype, copy=False), plate_dtype),
+        }
+
+    def export_hdf5(self, filename="world_data.h5", compression="gzip", steps=3):
+        # steps: смешивание цветов для пирамиды карты (None — без пирамиды)
+        from worldfile import create_world_file, create_layer, create_pyramid, build_pyramid
+        from spatial import write_indexes
+        with create_world_file(filename, self.WIDTH, self.HEIGHT) as f:
+            for name, (data, dtype) in self.hdf5_layers().items():
+                create_layer(f, name, data.shape, dtype, data=data, compression=compression)
+            f["biome"].attrs["colors"] = BIOME_COLORS
+            if steps is not None:
+                create_pyramid(f, self.blended_image(steps=steps), steps=steps, compression=compression)
+                build_pyramid(f, compression=compression)
+            write_indexes(f, self.biome, compression=compression)
+        profiling.count("hdf5_file_bytes", os.path.getsize(filename))
         print(f"[INFO] World data exported to {filename}")
 
+    # -----------------------------
+    # Инкрементальная перегенерация
+    # -----------------------------
+    def _clip(self, y0, y1, x0, x1):
+        return max(0, y0), min(self.HEIGHT, y1), max(0, x0), min(self.WIDTH, x1)
+
+    def regenerate(self, plates=None, rect=None, halo=HALO):
+        """
+        Пересчитывает стадии только вокруг изменений и патчит массивы на месте.
+        plates: индексы плит с изменённой скоростью/корой
+        rect: (y0, y1, x0, x1) области, где менялся plate_map
+        Область вывода — изменения плюс halo, считается в окне с ещё одним halo
+        (как тайл в tiled.py). Возвращает обновлённый rect или None.
+        """
+        if self.SEED is None:
+            raise ValueError("Incremental regeneration needs a seeded WorldGenerator")
+        boxes = [rect] if rect is not None else []
+        if plates is not None:
+            ys, xs = np.nonzero(np.isin(self.plate_id, list(plates)))
+            if ys.size:
+                # +1: границы с соседями классифицируются по парам клеток
+                boxes.append((int(ys.min()) - 1, int(ys.max()) + 2, int(xs.min()) - 1, int(xs.max()) + 2))
+        if not boxes:
+            return None
+        y0, y1 = min(b[0] for b in boxes), max(b[1] for b in boxes)
+        x0, x1 = min(b[2] for b in boxes), max(b[3] for b in boxes)
+        oy0, oy1, ox0, ox1 = self._clip(y0 - halo, y1 + halo, x0 - halo, x1 + halo)
+        wy0, wy1, wx0, wx1 = self._clip(oy0 - halo, oy1 + halo, ox0 - halo, ox1 + halo)
+
+        origin_x, origin_y = self.ORIGIN
+        window = WorldGenerator(width=wx1 - wx0, height=wy1 - wy0, plate_map=self.plate_map[wy0:wy1, wx0:wx1],
+                                plates=self.plates, origin=(origin_x + wx0, origin_y + wy0),
+                                world_size=self.WORLD_SIZE, seed=self.SEED)
+        window.create_base_world()
+        window.detect_boundaries()
+        window.apply_terrain()
+        window.assign_biomes()
+
+        core = (slice(oy0 - wy0, oy1 - wy0), slice(ox0 - wx0, ox1 - wx0))
+        for name in ("plate_id", "crust", "is_boundary", "boundary_type", "height", "moisture", "biome", "color"):
+            getattr(self, name)[oy0:oy1, ox0:ox1] = getattr(window, name)[core]
+        return oy0, oy1, ox0, ox1
+
+    def patch_hdf5(self, filename, rect):
+        """Перезаписывает область rect во всех слоях и уровнях пирамиды файла export_hdf5."""
+        from worldfile import open_world_file, write_region, update_pyramid, record_edit
+        from spatial import update_indexes
+        y0, y1, x0, x1 = rect
+        with open_world_file(filename, "r+") as f:
+            # Прежние биомы rect — для счётчиков индекса
+            old_biome = f["biome"][y0:y1, x0:x1] if "index" in f else None
+            for name, (data, _) in self.hdf5_layers(rect).items():
+                write_region(f[name], y0, x0, data)
+            if "pyramid" in f:
+                # Смешивание цветов тянет изменения на steps клеток; окно — ещё на steps
+                steps = int(f["pyramid"].attrs["steps"])
+                cy0, cy1, cx0, cx1 = self._clip(y0 - steps, y1 + steps, x0 - steps, x1 + steps)
+                wy0, wy1, wx0, wx1 = self._clip(cy0 - steps, cy1 + steps, cx0 - steps, cx1 + steps)
+                window = (slice(wy0, wy1), slice(wx0, wx1))
+                image = MapVisualizer.blend_biomes(self.color[window], self.height[window],
+                                                   np.isin(self.biome[window], WATER_BIOMES), steps=steps)
+                write_region(f["pyramid/color/0"], cy0, cx0, image[cy0 - wy0:cy1 - wy0, cx0 - wx0:cx1 - wx0])
+                update_pyramid(f, "color", cy0, cy1, cx0, cx1)
+                update_pyramid(f, "height", y0, y1, x0, x1)
+            if "index" in f:
+                update_indexes(f, self.biome, rect, old_biome)
+            # Сохранённые в игре чанки этой области устаревают (interact.ChunkCache)
+            record_edit(f, rect)
+        print(f"[INFO] World data patched in {filename} (rows {y0}:{y1}, cols {x0}:{x1})")
+
     # -----------------------------
     # Экспорт PNG с градиентами биомов
     # -----------------------------
+    def blended_image(self, steps=3, band=None):
+        # Полосами по band строк с полями steps: временные массивы смешивания
+        # (~170 байт на клетку) не зависят от размера мира
+        band = band or max(2 * steps + 1, BLEND_BAND_TILES // self.WIDTH)
+        image = np.empty_like(self.color)
+        for y0 in range(0, self.HEIGHT, band):
+            y1 = min(self.HEIGHT, y0 + band)
+            wy0, wy1 = max(0, y0 - steps), min(self.HEIGHT, y1 + steps)
+            water = np.isin(self.biome[wy0:wy1], WATER_BIOMES)
+            blended = MapVisualizer.blend_biomes(self.color[wy0:wy1], self.height[wy0:wy1], water, steps=steps)
+            image[y0:y1] = blended[y0 - wy0:y1 - wy0]
+        return image
+
     def export_png(self, filename="world_map_gradient.png", steps=3):
-        img = MapVisualizer.blend_biomes(self.world, steps=steps)
+        from PIL import Image
+        img = self.blended_image(steps=steps)
         Image.fromarray(img).save(filename)
         print(f"[INFO] World PNG exported to {filename}")
 
@@ -185,7 +570,8 @@ class WorldGenerator:
     # Экспорт PNG карты высот
     # -----------------------------
     def export_heightmap_png(self, filename="heightmap.png"):
-        height_array = np.array([[c.height for c in row] for row in self.world], dtype=np.float32)
+        from PIL import Image
+        height_array = self.height.astype(np.float32)
         min_h, max_h = height_array.min(), height_array.max()
         norm = ((height_array - min_h)/(max_h - min_h) * 255).astype(np.uint8)
         im = Image.fromarray(norm).convert("L")
@@ -0,0 +1,247 @@
+import os
+import uuid
+import numpy as np
+import h5py
+import profiling
+
+# -----------------------------
+# Формат world_data.h5
+# -----------------------------
+# v1: height/moisture float32, biome/crust_type — строки фиксированной длины (dtype 'S'),
+#     непрерывные несжатые наборы, атрибута schema_version нет.
+# v2: атрибуты schema_version=2, width, height, world_id (новый при каждом
+#     экспорте — по нему игра отделяет сохранённые чанки разных миров); категориальные слои (biome,
+#     crust_type, boundary_type) — HDF5 enum поверх uint8; plate_map int16/int32;
+#     все наборы чанкованы CHUNK×CHUNK и сжаты (gzip/lzf + shuffle).
+#
+# Пирамида (необязательно): pyramid/color/<k> (h, w, 3) uint8 и pyramid/height/<k>
+# float32, уровень k уменьшен в 2**k раз усреднением 2×2. color/0 — PNG-картинка
+# с градиентами, height/0 — жёсткая ссылка на height. Уровни строятся, пока
+# сторона больше PYRAMID_TILE; тайл пирамиды совпадает с чанком HDF5.
+#
+# Правки на месте (WorldGenerator.patch_hdf5): атрибут revision растёт на 1 за правку,
+# набор edits (N, 5) int64 — строки (revision, y0, y1, x0, x1) изменённых областей.
+# world_id при этом не меняется; сохранённые чанки сверяются с edits.
+SCHEMA_VERSION = 2
+CHUNK = 256
+COMPRESSION = "gzip"
+GZIP_LEVEL = 4
+PYRAMID_TILE = CHUNK
+
+
+def enum_dtype(names):
+    # code -> имя; None (нет значения) хранится как "none"
+    return h5py.enum_dtype({(name or "none"): code for code, name in enumerate(names)}, basetype="u1")
+
+
+def new_world_id():
+    return uuid.uuid4().hex
+
+
+def create_world_file(filename, width, height):
+    f = h5py.File(filename, "w")
+    f.attrs["schema_version"] = SCHEMA_VERSION
+    f.attrs["width"] = width
+    f.attrs["height"] = height
+    f.attrs["world_id"] = new_world_id()
+    return f
+
+
+def create_archive_file(filename, worlds):
+    # Пакетный архив: миры в группах worlds/<имя>, сводка в наборе index
+    f = h5py.File(filename, "w")
+    f.attrs["schema_version"] = SCHEMA_VERSION
+    f.attrs["worlds"] = worlds
+    return f
+
+
+def create_layer(f, name, shape, dtype, data=None, compression=COMPRESSION, chunk=CHUNK):
+    """
+    Создаёт слой по правилам v2: чанки chunk×chunk, сжатие с shuffle.
+    compression: "gzip", "lzf" или None
+    """
+    options = {}
+    if compression:
+        options = dict(compression=compression, shuffle=True)
+        if compression == "gzip":
+            options["compression_opts"] = GZIP_LEVEL
+    chunks = tuple(min(chunk, n) for n in shape)
+    if data is not None:
+        profiling.count("hdf5_bytes_written", data.nbytes)
+    return f.create_dataset(name, shape=shape, dtype=dtype, data=data, chunks=chunks, **options)
+
+
+def write_region(dataset, y0, x0, data):
+    dataset[y0:y0 + data.shape[0], x0:x0 + data.shape[1]] = data
+    profiling.count("hdf5_bytes_written", data.nbytes)
+
+
+def downsample2(block):
+    # Среднее 2×2 по первым двум осям; нечётный край дублируется
+    h, w = block.shape[:2]
+    if h % 2 or w % 2:
+        pad = [(0, h % 2), (0, w % 2)] + [(0, 0)] * (block.ndim - 2)
+        block = np.pad(block, pad, mode="edge")
+    acc = block.astype(np.float32)
+    acc = acc[0::2, 0::2] + acc[1::2, 0::2] + acc[0::2, 1::2] + acc[1::2, 1::2]
+    if np.issubdtype(block.dtype, np.integer):
+        return ((acc + 2) // 4).astype(block.dtype)
+    return (acc * 0.25).astype(block.dtype)
+
+
+def open_world_file(filename, mode="r"):
+    return h5py.File(filename, mode)
+
+
+def record_edit(f, rect):
+    """Записывает правку области rect = (y0, y1, x0, x1); возвращает новую ревизию."""
+    revision = int(f.attrs.get("revision", 0)) + 1
+    if "edits" not in f:
+        f.create_dataset("edits", shape=(0, 5), maxshape=(None, 5), dtype=np.int64, chunks=(256, 5))
+    edits = f["edits"]
+    edits.resize(len(edits) + 1, axis=0)
+    edits[-1] = (revision,) + tuple(int(v) for v in rect)
+    f.attrs["revision"] = revision
+    return revision
+
+
+def create_pyramid(f, image=None, steps=3, compression=COMPRESSION):
+    """
+    Начинает пирамиду: уровень 0 высот ссылается на height, уровень 0 цвета
+    создаётся (и заполняется image, если задан). Вернёт набор color/0 для
+    потоковой записи; остальные уровни достраивает build_pyramid.
+    """
+    height, width = f["height"].shape
+    f["pyramid/height/0"] = f["height"]
+    f["pyramid"].attrs["steps"] = steps
+    return create_layer(f, "pyramid/color/0", (height, width, 3), np.uint8, data=image,
+                        compression=compression)
+
+
+def build_pyramid(f, compression=COMPRESSION, tile=PYRAMID_TILE):
+    # Уровни 1.. читаются из предыдущего полосами по 2*tile строк — память не зависит от размера мира
+    levels = 1
+    for layer in ("color", "height"):
+        group = f["pyramid"][layer]
+        level = 0
+        while max(group[str(level)].shape[:2]) > tile:
+            src = group[str(level)]
+            h, w = src.shape[:2]
+            shape = ((h + 1) // 2, (w + 1) // 2) + src.shape[2:]
+            dst = create_layer(group, str(level + 1), shape, src.dtype, compression=compression, chunk=tile)
+            for y0 in range(0, h, 2 * tile):
+                write_region(dst, y0 // 2, 0, downsample2(src[y0:y0 + 2 * tile]))
+            level += 1
+        levels = level + 1
+    f["pyramid"].attrs["levels"] = levels
+    f["pyramid"].attrs["tile"] = tile
+
+
+def update_pyramid(f, layer, y0, y1, x0, x1):
+    # Пересчёт уровней 1.. над изменённой областью уровня 0 (границы выравниваются по чётным)
+    group = f["pyramid"][layer]
+    for level in range(1, int(f["pyramid"].attrs["levels"])):
+        src = group[str(level - 1)]
+        h, w = src.shape[:2]
+        y0, y1 = y0 // 2 * 2, min(h, (y1 + 1) // 2 * 2)
+        x0, x1 = x0 // 2 * 2, min(w, (x1 + 1) // 2 * 2)
+        write_region(group[str(level)], y0 // 2, x0 // 2, downsample2(src[y0:y1, x0:x1]))
+        y0, y1, x0, x1 = y0 // 2, (y1 + 1) // 2, x0 // 2, (x1 + 1) // 2
+
+
+class WorldFile:
+    """
+    Чтение world_data.h5 любой версии схемы.
+    Категориальные слои отдаются кодами (region) или именами (names/name_at).
+    group: мир внутри пакетного архива, например "worlds/world_00003"
+    """
+    def __init__(self, filename, group=None):
+        self.file = h5py.File(filename, "r")
+        self.version = int(self.file.attrs.get("schema_version", 1))
+        self.root = self.file[group] if group else self.file
+        self._lookups = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+
+    def __contains__(self, name):
+        return name in self.root
+
+    def __getitem__(self, name):
+        return self.root[name]
+
+    @property
+    def shape(self):
+        return self.root["height"].shape
+
+    @property
+    def world_id(self):
+        # Файлы без world_id (записанные раньше) различаются по размеру и времени изменения
+        world_id = self.root.attrs.get("world_id")
+        if world_id is None:
+            stat = os.stat(self.file.filename)
+            world_id = f"{stat.st_size:x}-{stat.st_mtime_ns:x}{self.root.name.replace('/', '-').rstrip('-')}"
+        return world_id.decode() if isinstance(world_id, bytes) else str(world_id)
+
+    @property
+    def revision(self):
+        # Число правок на месте (record_edit); 0 — файл не правился
+        return int(self.root.attrs.get("revision", 0))
+
+    def edits(self, since=0):
+        """(N, 5) строки (revision, y0, y1, x0, x1) правок новее ревизии since."""
+        if "edits" not in self.root:
+            return np.zeros((0, 5), dtype=np.int64)
+        edits = self.root["edits"][()]
+        return edits[edits[:, 0] > since]
+
+    @property
+    def pyramid_levels(self):
+        # 0, если пирамиды нет (старые файлы)
+        if "pyramid" not in self.root:
+            return 0
+        return int(self.root["pyramid"].attrs["levels"])
+
+    def pyramid_region(self, layer, level, y0, y1, x0, x1):
+        """Область уровня level пирамиды layer ("color" или "height")."""
+        return self.root[f"pyramid/{layer}/{level}"][y0:y1, x0:x1]
+
+    def pyramid_shape(self, level):
+        return self.root[f"pyramid/color/{level}"].shape[:2]
+
+    def lookup(self, name):
+        """Имена значений категориального слоя по коду (для v2) или None."""
+        if name not in self._lookups:
+            mapping = h5py.check_enum_dtype(self.root[name].dtype)
+            if mapping is None:
+                self._lookups[name] = None
+            else:
+                names = [None] * (max(mapping.values()) + 1)
+                for key, code in mapping.items():
+                    names[code] = key
+                self._lookups[name] = np.array(names, dtype=object)
+        return self._lookups[name]
+
+    def region(self, name, y0, y1, x0, x1):
+        return self.root[name][y0:y1, x0:x1]
+
+    def names(self, name, y0, y1, x0, x1):
+        """Категориальный слой в виде массива строк (object)."""
+        data = self.region(name, y0, y1, x0, x1)
+        table = self.lookup(name)
+        if table is not None:
+            return table[data]
+        return np.char.decode(data, "utf-8").astype(object)
+
+    def name_at(self, name, y, x):
+        value = self.root[name][y, x]
+        table = self.lookup(name)
+        if table is not None:
+            return table[value]
+        return value.decode("utf-8") if isinstance(value, bytes) else str(value)